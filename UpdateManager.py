@@ -1,151 +1,271 @@
-import datetime
 import os
-import pickle
 import asyncio
-from test_skin_exist import main, bugged_skins
-from typing import Dict, Tuple
+import datetime
+import json
+import shutil
+import tempfile
+import time
+from typing import Dict, List, Optional, Set, Tuple
+from test_skin_exist import check_skins
 import requests
-from sqlalchemy.orm import selectinload
+import requests.adapters
 from bs4 import BeautifulSoup
-from extractor import process_character_directory, get_script_dir
-from models.models import getApiVersion, seed_database, Champion
-from sqlmodel import Session, select
+from extractor import get_script_dir
+from models.models import getApiVersion, seed_database
+from version_resolver import version_resolver
+from sqlmodel import Session
 import logging
 
 logger = logging.getLogger(__name__)
-from skin_file_fetcher import download_skin
+from build_coordinator import rebuild_scheduler
+from rebuild_scheduler import PRIORITY_BACKGROUND
+from build_manifest import build_manifest
+from catalog_index import catalog_index
+from catalog_reads import catalog_reads
+from skin_file_fetcher import rebuild_character_index
+from source_changes import source_change_detector
+from hash_index import INDEX_TABLES, compile_hash_tables, index_file_name
+from metrics import stage_bytes, stage_duration
 import concurrent.futures
 
 
-class CDNSkinHashSet:
-    def __init__(self):
-        self.binary_data = os.path.join(os.path.dirname(__file__), "cache.bin")
-        try:
-            with open(self.binary_data, "rb") as f:
-                self.skin_Version_LastUpdateMap: Dict[
-                    str, Tuple[str, datetime.datetime]
-                ] = pickle.load(f)
-        except (pickle.UnpicklingError, EOFError, FileNotFoundError):
-            self.skin_Version_LastUpdateMap: Dict[
-                str, Tuple[str, datetime.datetime]
-            ] = {}
-
-    def get_skinSet(self) -> Dict[str, Tuple[str, datetime.datetime]]:
-        return self.skin_Version_LastUpdateMap
-
-    def update_cdn_entry(self, champ_num: str, skin_Num: str, apiVersion: str) -> None:
-        key = f"{champ_num}_{skin_Num}"
-        self.skin_Version_LastUpdateMap[key] = (apiVersion, datetime.datetime.utcnow())
-
-    def save_skinSet(self) -> None:
-        with open(self.binary_data, "wb") as f:
-            pickle.dump(self.skin_Version_LastUpdateMap, f)
-
-
 class UpdateManager:
     def __init__(self, session: Session):
-        self.cdnMap = CDNSkinHashSet()
         self.db = session
         self.apiVersion = getApiVersion()[:-2]
 
     def pull_changes_from_riot_api(self):
-        seed_database()
-
-    # def start_updating_cdn(self):
-    #     self.Champions_list = self.db.exec(select(Champion).options(selectinload(Champion.skins))).all()
-    #     map = self.cdnMap.get_skinSet()
-    #     script_dir = get_script_dir()
-    #     pool = concurrent.futures.ThreadPoolExecutor(max_workers=8)
-    #     for champ in self.Champions_list:
-    #         # Check if at least one skin is unprocessed
-    #         unprocessed_skins = [
-    #             skin for skin in champ.skins
-    #             if skin.id != "0" and (
-    #                     (entry := map.get(f"{champ.id}_{skin.id}")) is None or entry[0] != self.apiVersion
-    #             )
-    #         ]
-    #
-    #         limit = 10
-    #         if unprocessed_skins:
-    #             # Process all skins for this champion
-    #             for skin in unprocessed_skins:
-    #                 if limit > 0:
-    #                     pool.submit(self.extract_remote_skin,champ, script_dir, skin)
-    #                     # limit -= 1 #comment this if you want to update all the files
-    #                 else:
-    #                     break
-    #             #break  # Stop after processing one champion
-    #     self.cdnMap.save_skinSet()
+        previous_version = self.apiVersion
+        self.apiVersion = version_resolver.refresh()[:-2]
+        with stage_duration.time(stage="catalog_sync"):
+            changed = seed_database()
+        if changed:
+            catalog_index.invalidate()
+            catalog_reads.invalidate()
+        # the listing of a version does not change, only a new version needs a fresh index
+        rebuild_character_index(self.apiVersion, force=self.apiVersion != previous_version)
+
     async def start_updating_cdn(self):
-        await main()  # Run the async check first
-        map = self.cdnMap.get_skinSet()
+        with stage_duration.time(stage="availability_check"):
+            wanted = set(await check_skins(self.apiVersion))  # Run the async check first
+        logger.info(f"{len(wanted)} skins missing from the skins repo for {self.apiVersion}")
 
-        script_dir = get_script_dir()
-        # Use a proper session context
-        print(bugged_skins)
-        for champ_name, skin_name in bugged_skins:
-            # Get champion with skins eagerly loaded
-            print(champ_name)
-            champion = self.db.exec(
-                select(Champion)
-                .where(Champion.champ_name == champ_name)
-                .options(selectinload(Champion.skins))
-            ).first()
-
-            if champion:
-                for skin_record in champion.skins:
-                    if skin_record.skin_name == skin_name and (
-                        (entry := map.get(f"{champion.id}_{skin_record.id}")) is None
-                        or entry[0] != self.apiVersion
-                    ):  # Fixed comparison
-                        self.extract_remote_skin(champion, script_dir, skin_record)
-                        break
-                else:
-                    logger.warning(f"Skin not found: {champ_name} - {skin_name}")
-            else:
-                logger.warning(f"Champion not found: {champ_name}")
-        self.cdnMap.save_skinSet()
+        # a prebuild run may have recorded archives since the mirror was loaded
+        await asyncio.to_thread(build_manifest.reload)
+        built = {
+            (record.champion_id, record.skin_id)
+            for record in build_manifest.all()
+            if record.version == self.apiVersion
+        }
+        stale = wanted - built
+        # archives built for an earlier version only need a rebuild if their sources changed
+        outdated = [record for key in stale if (record := build_manifest.get(*key)) is not None]
+        if outdated:
+            unchanged = await asyncio.to_thread(source_change_detector.unchanged, self.apiVersion, outdated)
+            retagged = await asyncio.to_thread(build_manifest.retag, sorted(unchanged), self.apiVersion)
+            logger.info(f"Re-tagged {retagged} unchanged archives for {self.apiVersion}")
+            stale -= unchanged
+        # one transaction persists the whole batch, off the event loop
+        jobs = await asyncio.to_thread(self.extract_remote_skins, sorted(stale))
+
+        logger.info(f"Queued {len(jobs)} skin rebuilds: {rebuild_scheduler.status()}")
+        results = await asyncio.gather(*(asyncio.wrap_future(job) for job in jobs), return_exceptions=True)
+        failed = sum(isinstance(result, Exception) for result in results)
+        logger.info(f"Rebuilt {len(results) - failed}/{len(results)} skins: {rebuild_scheduler.status()}")
 
-    def extract_remote_skin(self, champ, script_dir, skin):
-        download_skin(champ.id, skin.id)
-        process_character_directory(script_dir, champ.id, skin.id, self.apiVersion)
-        self.cdnMap.update_cdn_entry(champ.id, skin.id, self.apiVersion)
+    def extract_remote_skins(self, skins: List[Tuple[str, str]]) -> List[concurrent.futures.Future]:
+        return rebuild_scheduler.submit_many(
+            [(self.apiVersion, champ_id, skin_id) for champ_id, skin_id in skins], PRIORITY_BACKGROUND, persist=True
+        )
 
 
 class HashUpdateManager:
-    def __init__(self):
-        self.url = "https://raw.communitydragon.org/data/hashes/lol/"
+    """Refreshes the CommunityDragon hash tables used by ritobin.
 
-    def update_hashes(self):
-        # Stream the HTML response to avoid buffering large content in memory
-        with requests.get(self.url) as response:
-            response.raise_for_status()
-            soup = BeautifulSoup(response.text, "html.parser")  # use raw stream
+    Every refresh builds a complete generation under hashes.d/<stamp>:
+    unchanged files (by stored ETag/Last-Modified/size) are hardlinked from
+    the current generation, changed ones are streamed straight to disk by a
+    pool of workers. The generation is mirrored into linux_binaries/hashes.d
+    with hardlinks, along with the mmap indexes compiled from it (see
+    hash_index), then both "hashes" paths are switched to it by replacing
+    a symlink, so a running ritobin only ever sees a complete table.
+    """
 
+    STATE_FILE = "state.json"
+
+    def __init__(self, workers: int = None):
+        self.url = "https://raw.communitydragon.org/data/hashes/lol/"
+        self.workers = workers or int(os.getenv("HASH_REFRESH_WORKERS", 4))
         script_dir = get_script_dir()
-        hashes_dirs = [
-            os.path.join(script_dir, "linux_binaries", "hashes"),
-            os.path.join(script_dir, "hashes"),
+        # (symlink that ritobin reads, directory holding its generations)
+        self.locations = [
+            (os.path.join(script_dir, "hashes"), os.path.join(script_dir, "hashes.d")),
+            (os.path.join(script_dir, "linux_binaries", "hashes"),
+             os.path.join(script_dir, "linux_binaries", "hashes.d")),
         ]
-        for dir_path in hashes_dirs:
-            os.makedirs(dir_path, exist_ok=True)
 
-        hashes_list = [
-            self.url + link.get("href")
+    def list_hash_files(self, session: requests.Session) -> List[str]:
+        with session.get(self.url, timeout=30) as response:
+            response.raise_for_status()
+            soup = BeautifulSoup(response.text, "html.parser")
+        return [
+            link.get("href")
             for link in soup.find_all("a")
-            if link.get("href") and not link.get("href").startswith("..")
+            if link.get("href") and not link.get("href").startswith("..") and not link.get("href").endswith("/")
         ]
 
-        for hash_file_link in hashes_list:
-            file_name = hash_file_link.split("/")[-1]
-            with requests.get(hash_file_link, stream=True) as file_response:
-                file_response.raise_for_status()
-                file_content = b""
-                for chunk in file_response.iter_content(chunk_size=8192):
-                    if chunk:
-                        file_content += chunk
-                file_text = file_content.decode("utf-8")
-                for dir_path in hashes_dirs:
-                    dest_path = os.path.join(dir_path, file_name)
-                    with open(dest_path, "w", encoding="utf-8") as hash_file:
-                        hash_file.write(file_text)
+    def _read_state(self) -> Dict[str, dict]:
+        try:
+            with open(os.path.join(self.locations[0][1], self.STATE_FILE), "r") as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
+
+    def _write_state(self, state: Dict[str, dict]) -> None:
+        path = os.path.join(self.locations[0][1], self.STATE_FILE)
+        with open(f"{path}.tmp", "w") as f:
+            json.dump(state, f)
+        os.replace(f"{path}.tmp", path)
+
+    @staticmethod
+    def _link_or_copy(src: str, dest: str) -> None:
+        try:
+            os.link(src, dest)
+        except OSError:
+            shutil.copy2(src, dest)
+
+    def fetch_hash_file(self, session: requests.Session, file_name: str, known: dict,
+                        current_dir: Optional[str], staging_dir: str) -> Tuple[str, dict, bool]:
+        """Place file_name in staging_dir; returns (name, state, changed)."""
+        dest = os.path.join(staging_dir, file_name)
+        previous = os.path.join(current_dir, file_name) if current_dir else None
+        have_previous = previous is not None and os.path.exists(previous)
+        headers = {}
+        if have_previous:
+            if known.get("etag"):
+                headers["If-None-Match"] = known["etag"]
+            if known.get("last_modified"):
+                headers["If-Modified-Since"] = known["last_modified"]
+
+        with session.get(self.url + file_name, headers=headers, stream=True, timeout=(10, 300)) as response:
+            if response.status_code != 304:
+                response.raise_for_status()
+            if response.status_code == 304:
+                state = dict(known)
+            else:
+                # validators come from this response only: a missing ETag must not inherit the
+                # old one, or the next check would take a changed file for unchanged
+                content_length = response.headers.get("Content-Length")
+                state = {
+                    "etag": response.headers.get("ETag"),
+                    "last_modified": response.headers.get("Last-Modified"),
+                    "size": int(content_length) if content_length else None,
+                }
+            unchanged = have_previous and (
+                response.status_code == 304
+                or (state["etag"] is not None and state["etag"] == known.get("etag"))
+                or (state["etag"] is None and state["last_modified"] is not None
+                    and state["last_modified"] == known.get("last_modified")
+                    and state["size"] is not None and state["size"] == known.get("size"))
+            )
+            if unchanged:
+                self._link_or_copy(previous, dest)
+                state["size"] = os.path.getsize(dest)
+                return file_name, state, False
+
+            size = 0
+            with open(dest, "wb") as hash_file:
+                for chunk in response.iter_content(chunk_size=1024 * 1024):
+                    hash_file.write(chunk)
+                    size += len(chunk)
+            state["size"] = size
+            stage_bytes.observe(size, stage="hash_download")
+            return file_name, state, True
+
+    @staticmethod
+    def _current_dir(link_path: str) -> Optional[str]:
+        if os.path.islink(link_path) or os.path.isdir(link_path):
+            return os.path.realpath(link_path)
+        return None
+
+    @staticmethod
+    def _swap_symlink(link_path: str, target: str) -> None:
+        """Point link_path at target in one rename; a legacy real directory is moved aside first."""
+        legacy = None
+        if os.path.isdir(link_path) and not os.path.islink(link_path):
+            legacy = f"{link_path}.legacy-{int(time.time())}"
+            os.rename(link_path, legacy)
+        tmp_link = f"{link_path}.tmp-{os.getpid()}"
+        if os.path.lexists(tmp_link):
+            os.remove(tmp_link)
+        os.symlink(os.path.relpath(target, os.path.dirname(link_path)), tmp_link)
+        os.replace(tmp_link, link_path)
+        if legacy is not None:
+            shutil.rmtree(legacy, ignore_errors=True)
+
+    @staticmethod
+    def _prune(generations_dir: str, keep: Set[str]) -> None:
+        # the previous generation is kept for ritobin processes that resolved it before the swap
+        generations = sorted(
+            name for name in os.listdir(generations_dir)
+            if os.path.isdir(os.path.join(generations_dir, name)) and not name.startswith(".")
+        )
+        for name in generations[:-2]:
+            if os.path.join(generations_dir, name) not in keep:
+                shutil.rmtree(os.path.join(generations_dir, name), ignore_errors=True)
+
+    def update_hashes(self) -> bool:
+        """Refresh the hash tables; returns False when nothing upstream changed."""
+        with stage_duration.time(stage="hash_refresh"):
+            return self._update_hashes()
+
+    def _update_hashes(self) -> bool:
+        primary_link, primary_dir = self.locations[0]
+        for link_path, generations_dir in self.locations:
+            os.makedirs(generations_dir, exist_ok=True)
+
+        state = self._read_state()
+        current_dir = self._current_dir(primary_link)
+        staging_dir = tempfile.mkdtemp(dir=primary_dir, prefix=".staging-")
+        try:
+            with requests.Session() as session:
+                adapter = requests.adapters.HTTPAdapter(pool_maxsize=self.workers)
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)
+                file_names = self.list_hash_files(session)
+                with concurrent.futures.ThreadPoolExecutor(max_workers=self.workers) as pool:
+                    results = list(pool.map(
+                        lambda name: self.fetch_hash_file(session, name, state.get(name, {}), current_dir, staging_dir),
+                        file_names,
+                    ))
+
+            changed = [name for name, _, was_changed in results if was_changed]
+            indexed = current_dir is not None and all(
+                os.path.exists(os.path.join(current_dir, index_file_name(kind))) for kind in INDEX_TABLES
+            )
+            if indexed and not changed and set(file_names) == set(state):
+                logger.info(f"Hash tables unchanged ({len(file_names)} files)")
+                shutil.rmtree(staging_dir, ignore_errors=True)
+                return False
+
+            compile_hash_tables(staging_dir)
+            generation = datetime.datetime.utcnow().strftime("%Y%m%d%H%M%S")
+            targets = [os.path.join(primary_dir, generation)]
+            os.chmod(staging_dir, 0o755)
+            os.rename(staging_dir, targets[0])
+            for _, generations_dir in self.locations[1:]:
+                mirror = os.path.join(generations_dir, generation)
+                os.makedirs(mirror, exist_ok=True)
+                for file_name in os.listdir(targets[0]):
+                    self._link_or_copy(os.path.join(targets[0], file_name), os.path.join(mirror, file_name))
+                targets.append(mirror)
+
+            for (link_path, generations_dir), target in zip(self.locations, targets):
+                self._swap_symlink(link_path, target)
+                self._prune(generations_dir, {target})
+            self._write_state({name: file_state for name, file_state, _ in results})
+            logger.info(f"Hash tables switched to {generation}: {len(changed)}/{len(file_names)} files changed")
+            return True
+        except BaseException:
+            shutil.rmtree(staging_dir, ignore_errors=True)
+            raise
@@ -0,0 +1,99 @@
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+SIDECAR_NAME = "skinbase.keys.json"
+# Files whose hash guards the cached keys: the downloaded skin0.bin, then the copies
+# older folders keep when skin0.bin is missing
+SOURCE_NAMES = ("skin0.bin", "skinbase.bin", "skinbase.json")
+
+
+class BaseSkinCache:
+    """LRU of base-skin entry keys per (version, champion, character folder).
+
+    Entries map to the base title key and ResourceResolver key (as u32 hashes
+    and, once the ritobin path has seen them, as ritobin JSON keys). They are
+    mirrored in a skinbase.keys.json sidecar in the folder and dropped as
+    soon as the hash of the base skin file they came from changes.
+    """
+
+    def __init__(self, max_entries: int = 512):
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.entries: "OrderedDict[Tuple[str, ...], Tuple[Tuple[int, int], Dict[str, Any]]]" = OrderedDict()
+
+    @staticmethod
+    def _key(folder_path: str) -> Tuple[str, ...]:
+        # .../base_skinsfiles/<version>/<champ_id>/<folder>
+        return tuple(os.path.normpath(folder_path).split(os.sep)[-3:])
+
+    @staticmethod
+    def _source(folder_path: str) -> Optional[str]:
+        for name in SOURCE_NAMES:
+            path = os.path.join(folder_path, name)
+            if os.path.exists(path):
+                return path
+        return None
+
+    @staticmethod
+    def _hash(path: str) -> str:
+        with open(path, "rb") as f:
+            return hashlib.sha256(f.read()).hexdigest()
+
+    def lookup(self, folder_path: str) -> Dict[str, Any]:
+        """Return the cached keys of a folder, or {} when they are unknown or stale."""
+        source = self._source(folder_path)
+        if source is None:
+            return {}
+        stat = os.stat(source)
+        signature = (stat.st_size, stat.st_mtime_ns)
+        key = self._key(folder_path)
+        with self.lock:
+            cached = self.entries.get(key)
+            if cached is not None and cached[0] == signature:
+                self.entries.move_to_end(key)
+                return cached[1]
+
+        try:
+            with open(os.path.join(folder_path, SIDECAR_NAME), "r") as f:
+                entry = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
+        if entry.get("source") != os.path.basename(source) or entry.get("source_hash") != self._hash(source):
+            logger.info(f"Base skin of {'/'.join(key)} changed, dropping cached keys")
+            return {}
+        self._remember(key, signature, entry)
+        return entry
+
+    def store(self, folder_path: str, **keys) -> None:
+        """Merge keys into the folder's entry and rewrite its sidecar."""
+        source = self._source(folder_path)
+        if source is None:
+            return
+        entry = dict(self.lookup(folder_path))
+        entry.update(keys)
+        entry["source"] = os.path.basename(source)
+        entry["source_hash"] = self._hash(source)
+        fd, tmp_path = tempfile.mkstemp(dir=folder_path, prefix=".", suffix=".tmp")
+        with os.fdopen(fd, "w") as f:
+            json.dump(entry, f)
+        os.replace(tmp_path, os.path.join(folder_path, SIDECAR_NAME))
+        stat = os.stat(source)
+        self._remember(self._key(folder_path), (stat.st_size, stat.st_mtime_ns), entry)
+
+    def _remember(self, key: Tuple[str, ...], signature: Tuple[int, int], entry: Dict[str, Any]) -> None:
+        with self.lock:
+            self.entries[key] = (signature, entry)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+
+base_skin_cache = BaseSkinCache(int(os.getenv("BASE_SKIN_CACHE_SIZE", 512)))
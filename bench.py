@@ -0,0 +1,357 @@
+"""Reproducible benchmark of the skin service against a local ddragon / Community Dragon stand-in.
+
+    python bench.py [--champions 8] [--skins 6] [--requests 400] [--output results.json] [--compare old.json]
+
+The service code is copied into a scratch directory and run there against
+synthetic BIN fixtures, so the benchmark never touches the real database,
+cdn/ or base_skinsfiles/ and never leaves the machine.
+"""
+import argparse
+import functools
+import json
+import logging
+import os
+import platform
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Tuple
+
+logger = logging.getLogger(__name__)
+
+DDRAGON_VERSION = "15.1.1"
+BUILD_VERSION = DDRAGON_VERSION.rsplit(".", 1)[0]
+# metrics where a higher value is better, everything else compares lower-is-better
+HIGHER_IS_BETTER = {"builds_per_second", "batch_builds_per_second", "requests_per_second"}
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def percentiles(samples: List[float]) -> Dict[str, float]:
+    if not samples:
+        return {}
+    ordered = sorted(samples)
+
+    def rank(p: float) -> float:
+        return ordered[min(len(ordered) - 1, max(0, int(round(p / 100 * len(ordered))) - 1))]
+
+    return {
+        "count": len(ordered),
+        "p50_ms": round(rank(50) * 1000, 2),
+        "p90_ms": round(rank(90) * 1000, 2),
+        "p99_ms": round(rank(99) * 1000, 2),
+        "max_ms": round(ordered[-1] * 1000, 2),
+        "mean_ms": round(sum(ordered) / len(ordered) * 1000, 2),
+    }
+
+
+# -- fixtures ---------------------------------------------------------------
+
+def synthetic_skin_bin(code: str, skin_num: int, size: int, rng: random.Random) -> bytes:
+    """A PROP BIN shaped like a skin file: title entry, filler entries, trailing ResourceResolver."""
+    from bin_codec import BinFile, EMBED, F32, HASH, LINK, LIST, MAP, RESOURCE_RESOLVER_HASH, STRING, U32, VEC3
+    from bin_codec import write_bin
+    from hashing import fnv1a
+
+    prefix = f"Characters/{code}/Skins/Skin{skin_num}"
+    entries = [(fnv1a(prefix), fnv1a("SkinCharacterDataProperties"), [
+        (fnv1a("championSkinName"), STRING, f"{code}Skin{skin_num:02d}"),
+        (fnv1a("skinScale"), F32, 1.0 + skin_num / 100),
+        (fnv1a("iconCircle"), STRING, f"ASSETS/Characters/{code}/HUD/{code}_Circle_{skin_num}.dds"),
+    ])]
+    resolver_items = []
+    # a filler entry encodes to roughly 260 bytes
+    for i in range(max(1, size // 260)):
+        path = f"{prefix}/Particles/{code}_Skin{skin_num:02d}_Effect{i:04d}"
+        entries.append((fnv1a(path), fnv1a("VfxSystemDefinitionData"), [
+            (fnv1a("particlePath"), STRING, path),
+            (fnv1a("particleName"), STRING, f"{code}_Skin{skin_num:02d}_Effect{i:04d}"),
+            (fnv1a("flags"), U32, rng.getrandbits(16)),
+            (fnv1a("complexEmitterDefinitionData"), LIST, (EMBED, [
+                (fnv1a("VfxEmitterDefinitionData"), [
+                    (fnv1a("emitterName"), STRING, f"emitter{j}"),
+                    (fnv1a("birthTranslation"), VEC3, (rng.random(), rng.random(), rng.random())),
+                ])
+                for j in range(3)
+            ])),
+        ]))
+        resolver_items.append((fnv1a(f"{code}_Effect{i}"), fnv1a(path)))
+    entries.append((fnv1a(f"{prefix}/Resources"), RESOURCE_RESOLVER_HASH, [
+        (fnv1a("resourceMap"), MAP, (HASH, LINK, resolver_items)),
+    ]))
+    return write_bin(BinFile(3, [], entries))
+
+
+def write_fixtures(root: str, champions: int, skins: int, bin_size: int, seed: int) -> List[Tuple[str, str]]:
+    """Lay out ddragon and Community Dragon trees under root; returns the (champ_key, skin_num) targets."""
+    rng = random.Random(seed)
+    ddragon = os.path.join(root, "ddragon")
+    data_dir = os.path.join(ddragon, "cdn", DDRAGON_VERSION, "data", "en_US")
+    characters = os.path.join(root, "cdragon", BUILD_VERSION, "game", "data", "characters")
+    os.makedirs(os.path.join(data_dir, "champion"), exist_ok=True)
+    os.makedirs(os.path.join(ddragon, "api"), exist_ok=True)
+    with open(os.path.join(ddragon, "api", "versions.json"), "w") as f:
+        json.dump([DDRAGON_VERSION, "14.24.1"], f)
+
+    summary = {}
+    targets = []
+    for c in range(champions):
+        code = f"Bench{c:02d}"
+        key = str(9000 + c)
+        skin_list = [{"num": 0, "name": "default"}] + [
+            {"num": n, "name": f"{code} Skin {n}"} for n in range(1, skins + 1)
+        ]
+        details = {"id": code, "key": key, "name": f"Bench {c:02d}", "skins": skin_list}
+        summary[code] = {k: details[k] for k in ("id", "key", "name")}
+        with open(os.path.join(data_dir, "champion", f"{code}.json"), "w") as f:
+            json.dump({"data": {code: details}}, f)
+        # every champion has its own folder plus a companion one, like annie and annietibbers
+        for folder in (code.lower(), f"{code.lower()}companion"):
+            skins_dir = os.path.join(characters, folder, "skins")
+            os.makedirs(skins_dir, exist_ok=True)
+            for n in range(0, skins + 1):
+                if folder.endswith("companion") and n % 2:
+                    continue  # companions lack some skins and fall back to skin0
+                with open(os.path.join(skins_dir, f"skin{n}.bin"), "wb") as f:
+                    f.write(synthetic_skin_bin(code, n, bin_size, rng))
+        targets.extend((key, str(n)) for n in range(1, skins + 1))
+    with open(os.path.join(data_dir, "champion.json"), "w") as f:
+        json.dump({"data": summary}, f)
+    return targets
+
+
+class _QuietHandler(SimpleHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+def start_fixture_server(root: str) -> Tuple[ThreadingHTTPServer, str]:
+    server = ThreadingHTTPServer(("127.0.0.1", 0), functools.partial(_QuietHandler, directory=root))
+    threading.Thread(target=server.serve_forever, name="bench-fixtures", daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+
+def copy_service(source: str, dest: str) -> None:
+    """Copy the service code only, leaving every runtime artifact behind."""
+    os.makedirs(dest)
+    for name in os.listdir(source):
+        path = os.path.join(source, name)
+        if name.endswith(".py") or name == "info.json":
+            shutil.copy2(path, dest)
+    shutil.copytree(os.path.join(source, "models"), os.path.join(dest, "models"),
+                    ignore=shutil.ignore_patterns("__pycache__"))
+
+
+# -- measurement (runs inside the copied service) ----------------------------
+
+def run_worker(config_path: str) -> None:
+    import resource
+    import requests
+    import uvicorn
+
+    with open(config_path, "r") as f:
+        config = json.load(f)
+    targets = [tuple(target) for target in config["targets"]]
+    results = {}
+
+    from models.models import create_db_and_tables, seed_database
+    create_db_and_tables()
+    started = time.perf_counter()
+    seed_database(force=True)
+    results["seed_database_cold_s"] = round(time.perf_counter() - started, 4)
+    started = time.perf_counter()
+    seed_database()
+    results["seed_database_warm_s"] = round(time.perf_counter() - started, 4)
+
+    import main
+    port = free_port()
+    server = uvicorn.Server(uvicorn.Config(main.app, host="127.0.0.1", port=port, lifespan="off", log_level="warning"))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.01)
+    base_url = f"http://127.0.0.1:{port}"
+
+    cold = []
+    with requests.Session() as http:
+        for champ_id, skin_id in targets:
+            started = time.perf_counter()
+            response = http.get(f"{base_url}/skin/{champ_id}/{skin_id}")
+            cold.append(time.perf_counter() - started)
+            response.raise_for_status()
+    results["skin_cold"] = percentiles(cold)
+
+    rng = random.Random(config["seed"])
+    picks = [rng.choice(targets) for _ in range(config["requests"])]
+    local = threading.local()
+
+    def fetch(target) -> float:
+        http = getattr(local, "http", None)
+        if http is None:
+            http = local.http = requests.Session()
+        started = time.perf_counter()
+        response = http.get(f"{base_url}/skin/{target[0]}/{target[1]}")
+        response.raise_for_status()
+        return time.perf_counter() - started
+
+    with ThreadPoolExecutor(max_workers=config["concurrency"]) as pool:
+        started = time.perf_counter()
+        warm = list(pool.map(fetch, picks))
+        elapsed = time.perf_counter() - started
+    results["skin_warm"] = percentiles(warm)
+    results["skin_warm"]["requests_per_second"] = round(len(warm) / elapsed, 1)
+
+    from extractor import get_script_dir, process_character_directory
+    script_dir = get_script_dir()
+    started = time.perf_counter()
+    for champ_id, skin_id in targets:
+        if process_character_directory(script_dir, champ_id, skin_id, BUILD_VERSION) is None:
+            raise RuntimeError(f"Build of {champ_id}/{skin_id} failed")
+    elapsed = time.perf_counter() - started
+    results["builds_per_second"] = round(len(targets) / elapsed, 2)
+
+    from extractor import process_character_skins
+    by_champion: Dict[str, List[str]] = {}
+    for champ_id, skin_id in targets:
+        by_champion.setdefault(champ_id, []).append(skin_id)
+    started = time.perf_counter()
+    for champ_id, skin_ids in by_champion.items():
+        report = process_character_skins(script_dir, champ_id, skin_ids, BUILD_VERSION)
+        failed = [skin_id for skin_id, result in report.items() if not result["ok"]]
+        if failed:
+            raise RuntimeError(f"Batch build of {champ_id} failed for skins {failed}")
+    elapsed = time.perf_counter() - started
+    results["batch_builds_per_second"] = round(len(targets) / elapsed, 2)
+    results["peak_rss_bytes"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+    server.should_exit = True
+    with open(config["output"], "w") as f:
+        json.dump(results, f)
+
+
+# -- driver -----------------------------------------------------------------
+
+def flatten(results: Dict, prefix: str = "") -> Dict[str, float]:
+    flat = {}
+    for key, value in results.items():
+        if isinstance(value, dict):
+            flat.update(flatten(value, f"{prefix}{key}."))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[f"{prefix}{key}"] = value
+    return flat
+
+
+def compare(current: Dict, baseline: Dict) -> List[str]:
+    """One line per metric with its relative change; regressions are flagged."""
+    lines = []
+    now, before = flatten(current["metrics"]), flatten(baseline["metrics"])
+    for key in sorted(now.keys() & before.keys()):
+        if not before[key] or key.endswith(".count"):
+            continue
+        change = (now[key] - before[key]) / before[key] * 100
+        worse = change < 0 if key.split(".")[-1] in HIGHER_IS_BETTER else change > 0
+        flag = "  REGRESSION" if worse and abs(change) >= 10 else ""
+        lines.append(f"{key:40} {before[key]:>14} -> {now[key]:>14} ({change:+.1f}%){flag}")
+    return lines
+
+
+def git_revision(repo: str) -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=repo, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Benchmark skin builds and serving against local fixtures")
+    parser.add_argument("--champions", type=int, default=8)
+    parser.add_argument("--skins", type=int, default=6, help="skins per champion, besides the default one")
+    parser.add_argument("--bin-kb", type=int, default=96, help="approximate size of each fixture BIN")
+    parser.add_argument("--requests", type=int, default=400, help="warm /skin requests")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", help="results file, defaults to bench_results/bench-<time>.json")
+    parser.add_argument("--compare", help="earlier results file to diff against")
+    parser.add_argument("--keep", action="store_true", help="keep the scratch directory")
+    parser.add_argument("--worker", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.worker:
+        run_worker(args.worker)
+        return 0
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+    repo = os.path.dirname(os.path.abspath(__file__))
+    scratch = tempfile.mkdtemp(prefix="skin-bench-")
+    server = None
+    try:
+        fixtures = os.path.join(scratch, "fixtures")
+        targets = write_fixtures(fixtures, args.champions, args.skins, args.bin_kb * 1024, args.seed)
+        server, fixture_url = start_fixture_server(fixtures)
+        app_dir = os.path.join(scratch, "app")
+        copy_service(repo, app_dir)
+        logger.info(f"Fixtures for {len(targets)} skins served from {fixture_url}")
+
+        config_path = os.path.join(scratch, "config.json")
+        worker_output = os.path.join(scratch, "worker.json")
+        with open(config_path, "w") as f:
+            json.dump({"targets": targets, "requests": args.requests, "concurrency": args.concurrency,
+                       "seed": args.seed, "output": worker_output}, f)
+        env = dict(os.environ)
+        env.update({
+            "DDRAGON_BASE_URL": f"{fixture_url}/ddragon",
+            "COMMUNITY_DRAGON_BASE_URL": f"{fixture_url}/cdragon",
+            "SCRATCH_DIR": os.path.join(scratch, "work"),
+        })
+        env.pop("Environment", None)
+        os.makedirs(env["SCRATCH_DIR"])
+        subprocess.run([sys.executable, "bench.py", "--worker", config_path], cwd=app_dir, env=env, check=True)
+        with open(worker_output, "r") as f:
+            metrics = json.load(f)
+    finally:
+        if server is not None:
+            server.shutdown()
+        if args.keep:
+            logger.info(f"Scratch directory kept at {scratch}")
+        else:
+            shutil.rmtree(scratch, ignore_errors=True)
+
+    report = {
+        "timestamp": datetime.utcnow().isoformat(timespec="seconds"),
+        "revision": git_revision(repo),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "parameters": {k: v for k, v in vars(args).items() if k not in ("worker", "output", "compare", "keep")},
+        "metrics": metrics,
+    }
+    output = args.output or os.path.join(
+        repo, "bench_results", f"bench-{datetime.utcnow().strftime('%Y%m%d-%H%M%S')}.json"
+    )
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(json.dumps(metrics, indent=2))
+    print(f"Results written to {output}")
+
+    if args.compare:
+        with open(args.compare, "r") as f:
+            baseline = json.load(f)
+        print(f"Compared with {baseline.get('revision')} from {baseline.get('timestamp')}:")
+        print("\n".join(compare(report, baseline)))
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
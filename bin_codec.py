@@ -0,0 +1,414 @@
+import logging
+import struct
+from typing import Any, Dict, List, Optional, Tuple
+
+from hashing import fnv1a
+
+logger = logging.getLogger(__name__)
+
+RESOURCE_RESOLVER_HASH = fnv1a("ResourceResolver")
+
+# Property value types as written by current ritobin builds.
+NONE, BOOL, I8, U8, I16, U16, I32, U32, I64, U64, F32 = range(11)
+VEC2, VEC3, VEC4, MTX44, RGBA, STRING, HASH, FILE = range(11, 19)
+LIST, LIST2, POINTER, EMBED, LINK, OPTION, MAP, FLAG = range(0x80, 0x88)
+
+FIXED_TYPES = {
+    NONE: "",
+    BOOL: "<?",
+    I8: "<b",
+    U8: "<B",
+    I16: "<h",
+    U16: "<H",
+    I32: "<i",
+    U32: "<I",
+    I64: "<q",
+    U64: "<Q",
+    F32: "<f",
+    VEC2: "<2f",
+    VEC3: "<3f",
+    VEC4: "<4f",
+    MTX44: "<16f",
+    RGBA: "<4B",
+    HASH: "<I",
+    FILE: "<Q",
+    LINK: "<I",
+    FLAG: "<B",
+}
+
+
+class BinFormatError(Exception):
+    """Raised when a buffer is not a BIN file this codec understands."""
+
+
+class BinFile:
+    """Parsed property tree of a BIN file.
+
+    entries is a list of (path_hash, class_hash, fields) and every field is a
+    (name_hash, type, value) tuple, so the tree keeps the on-disk order and can
+    be written back byte for byte.
+    """
+
+    def __init__(self, version: int, linked: List[str], entries: List[Tuple[int, int, list]],
+                 patch_header: Optional[bytes] = None, patches: Optional[list] = None):
+        self.version = version
+        self.linked = linked
+        self.entries = entries
+        self.patch_header = patch_header
+        self.patches = patches if patches is not None else []
+
+    def find_entries(self, class_hash: int) -> List[int]:
+        return [i for i, entry in enumerate(self.entries) if entry[1] == class_hash]
+
+
+class _Reader:
+    def __init__(self, data: bytes):
+        self.data = data
+        self.pos = 0
+
+    def unpack(self, fmt: str):
+        size = struct.calcsize(fmt)
+        if self.pos + size > len(self.data):
+            raise BinFormatError(f"Unexpected end of data at offset {self.pos}")
+        values = struct.unpack_from(fmt, self.data, self.pos)
+        self.pos += size
+        return values
+
+    def read(self, fmt: str):
+        return self.unpack(fmt)[0]
+
+    def read_bytes(self, size: int) -> bytes:
+        if self.pos + size > len(self.data):
+            raise BinFormatError(f"Unexpected end of data at offset {self.pos}")
+        chunk = self.data[self.pos:self.pos + size]
+        self.pos += size
+        return chunk
+
+    def read_string(self) -> str:
+        return self.read_bytes(self.read("<H")).decode("utf-8")
+
+    def read_type(self) -> int:
+        value_type = self.read("<B")
+        if value_type not in FIXED_TYPES and value_type not in (STRING, LIST, LIST2, POINTER, EMBED, OPTION, MAP):
+            raise BinFormatError(f"Unsupported value type {value_type:#x} at offset {self.pos - 1}")
+        return value_type
+
+    def read_fields(self, count: int) -> list:
+        fields = []
+        for _ in range(count):
+            name_hash = self.read("<I")
+            value_type = self.read_type()
+            fields.append((name_hash, value_type, self.read_value(value_type)))
+        return fields
+
+    def read_value(self, value_type: int) -> Any:
+        if value_type == STRING:
+            return self.read_string()
+        if value_type in (LIST, LIST2):
+            item_type = self.read_type()
+            self.read("<I")
+            count = self.read("<I")
+            return item_type, [self.read_value(item_type) for _ in range(count)]
+        if value_type in (POINTER, EMBED):
+            class_hash = self.read("<I")
+            if class_hash == 0 and value_type == POINTER:
+                return 0, None
+            self.read("<I")
+            return class_hash, self.read_fields(self.read("<H"))
+        if value_type == OPTION:
+            item_type = self.read_type()
+            count = self.read("<B")
+            return item_type, [self.read_value(item_type) for _ in range(count)]
+        if value_type == MAP:
+            key_type = self.read_type()
+            item_type = self.read_type()
+            self.read("<I")
+            count = self.read("<I")
+            return key_type, item_type, [
+                (self.read_value(key_type), self.read_value(item_type)) for _ in range(count)
+            ]
+        fmt = FIXED_TYPES[value_type]
+        if not fmt:
+            return None
+        values = self.unpack(fmt)
+        return values[0] if len(values) == 1 else values
+
+
+class _Writer:
+    def __init__(self):
+        self.buffer = bytearray()
+
+    def write(self, fmt: str, *values) -> None:
+        self.buffer += struct.pack(fmt, *values)
+
+    def write_string(self, value: str) -> None:
+        encoded = value.encode("utf-8")
+        self.write("<H", len(encoded))
+        self.buffer += encoded
+
+    def reserve_size(self) -> int:
+        offset = len(self.buffer)
+        self.buffer += b"\0\0\0\0"
+        return offset
+
+    def fill_size(self, offset: int) -> None:
+        struct.pack_into("<I", self.buffer, offset, len(self.buffer) - offset - 4)
+
+    def write_fields(self, fields: list) -> None:
+        for name_hash, value_type, value in fields:
+            self.write("<IB", name_hash, value_type)
+            self.write_value(value_type, value)
+
+    def write_value(self, value_type: int, value: Any) -> None:
+        if value_type == STRING:
+            self.write_string(value)
+        elif value_type in (LIST, LIST2):
+            item_type, items = value
+            self.write("<B", item_type)
+            size_at = self.reserve_size()
+            self.write("<I", len(items))
+            for item in items:
+                self.write_value(item_type, item)
+            self.fill_size(size_at)
+        elif value_type in (POINTER, EMBED):
+            class_hash, fields = value
+            self.write("<I", class_hash)
+            if fields is None:
+                return
+            size_at = self.reserve_size()
+            self.write("<H", len(fields))
+            self.write_fields(fields)
+            self.fill_size(size_at)
+        elif value_type == OPTION:
+            item_type, items = value
+            self.write("<BB", item_type, len(items))
+            for item in items:
+                self.write_value(item_type, item)
+        elif value_type == MAP:
+            key_type, item_type, items = value
+            self.write("<BB", key_type, item_type)
+            size_at = self.reserve_size()
+            self.write("<I", len(items))
+            for key, item in items:
+                self.write_value(key_type, key)
+                self.write_value(item_type, item)
+            self.fill_size(size_at)
+        else:
+            fmt = FIXED_TYPES[value_type]
+            if not fmt:
+                return
+            if isinstance(value, tuple):
+                self.write(fmt, *value)
+            else:
+                self.write(fmt, value)
+
+
+def _read_header(reader: _Reader) -> Tuple[Optional[bytes], int, List[str]]:
+    magic = reader.read_bytes(4)
+    patch_header = None
+    if magic == b"PTCH":
+        patch_header = reader.read_bytes(8)
+        magic = reader.read_bytes(4)
+    if magic != b"PROP":
+        raise BinFormatError(f"Bad magic {magic!r}")
+    version = reader.read("<I")
+    linked = []
+    if version >= 2:
+        linked = [reader.read_string() for _ in range(reader.read("<I"))]
+    return patch_header, version, linked
+
+
+def read_bin(data: bytes) -> BinFile:
+    """Parse a BIN buffer into a BinFile property tree."""
+    reader = _Reader(data)
+    patch_header, version, linked = _read_header(reader)
+    entry_count = reader.read("<I")
+    class_hashes = reader.unpack(f"<{entry_count}I")
+    entries = []
+    for class_hash in class_hashes:
+        size = reader.read("<I")
+        end = reader.pos + size
+        path_hash, field_count = reader.unpack("<IH")
+        entries.append((path_hash, class_hash, reader.read_fields(field_count)))
+        if reader.pos != end:
+            raise BinFormatError(f"Entry {path_hash:#010x} size mismatch")
+    patches = []
+    if patch_header is not None and version >= 3:
+        for _ in range(reader.read("<I")):
+            path_hash = reader.read("<I")
+            reader.read("<I")
+            value_type = reader.read_type()
+            path = reader.read_string()
+            patches.append((path_hash, path, value_type, reader.read_value(value_type)))
+    if reader.pos != len(data):
+        raise BinFormatError(f"{len(data) - reader.pos} trailing bytes after last entry")
+    return BinFile(version, linked, entries, patch_header, patches)
+
+
+def write_bin(bin_file: BinFile) -> bytes:
+    """Serialize a BinFile the same way ritobin writes it."""
+    writer = _Writer()
+    if bin_file.patch_header is not None:
+        writer.buffer += b"PTCH" + bin_file.patch_header
+    writer.buffer += b"PROP"
+    writer.write("<I", bin_file.version)
+    if bin_file.version >= 2:
+        writer.write("<I", len(bin_file.linked))
+        for linked in bin_file.linked:
+            writer.write_string(linked)
+    writer.write("<I", len(bin_file.entries))
+    for _, class_hash, _ in bin_file.entries:
+        writer.write("<I", class_hash)
+    for path_hash, _, fields in bin_file.entries:
+        size_at = writer.reserve_size()
+        writer.write("<IH", path_hash, len(fields))
+        writer.write_fields(fields)
+        writer.fill_size(size_at)
+    if bin_file.patch_header is not None and bin_file.version >= 3:
+        writer.write("<I", len(bin_file.patches))
+        for path_hash, path, value_type, value in bin_file.patches:
+            writer.write("<I", path_hash)
+            size_at = writer.reserve_size()
+            writer.write("<B", value_type)
+            writer.write_string(path)
+            writer.write_value(value_type, value)
+            writer.fill_size(size_at)
+    return bytes(writer.buffer)
+
+
+def _entry_layout(data: bytes) -> List[Tuple[int, int]]:
+    """Return (class_hash, path_hash_offset) for every entry without decoding fields."""
+    reader = _Reader(data)
+    _read_header(reader)
+    entry_count = reader.read("<I")
+    class_hashes = reader.unpack(f"<{entry_count}I")
+    layout = []
+    for class_hash in class_hashes:
+        size = reader.read("<I")
+        if size < 6 or reader.pos + size > len(data):
+            raise BinFormatError(f"Entry size {size} out of bounds at offset {reader.pos - 4}")
+        layout.append((class_hash, reader.pos))
+        reader.pos += size
+    return layout
+
+
+def _resolver_offsets(layout: List[Tuple[int, int]]) -> List[int]:
+    # Mirrors the JSON patching: only the trailing ResourceResolver when it is last.
+    if layout and layout[-1][0] == RESOURCE_RESOLVER_HASH:
+        return [layout[-1][1]]
+    return [offset for class_hash, offset in layout if class_hash == RESOURCE_RESOLVER_HASH]
+
+
+def read_entry_keys(data: bytes) -> Tuple[int, Optional[int]]:
+    """Return the first entry key and the ResourceResolver key of a BIN buffer."""
+    layout = _entry_layout(data)
+    if not layout:
+        raise BinFormatError("BIN file has no entries")
+    title_key = struct.unpack_from("<I", data, layout[0][1])[0]
+    resolver_offsets = _resolver_offsets(layout)
+    resolver_key = struct.unpack_from("<I", data, resolver_offsets[0])[0] if resolver_offsets else None
+    return title_key, resolver_key
+
+
+def patch_entry_keys(data: bytes, title_key: int, resolver_key: Optional[int]) -> bytes:
+    """Rewrite the first entry key and the ResourceResolver key in place.
+
+    Produces the same bytes as converting to JSON, editing both keys and
+    converting back with ritobin, without touching the rest of the buffer.
+    """
+    layout = _entry_layout(data)
+    if not layout:
+        raise BinFormatError("BIN file has no entries")
+    patched = bytearray(data)
+    struct.pack_into("<I", patched, layout[0][1], title_key)
+    if resolver_key is not None:
+        for offset in _resolver_offsets(layout):
+            struct.pack_into("<I", patched, offset, resolver_key)
+    return bytes(patched)
+
+
+def patch_entry_keys_tree(data: bytes, title_key: int, resolver_key: Optional[int]) -> bytes:
+    """Same as patch_entry_keys but goes through the full property tree."""
+    bin_file = read_bin(data)
+    if not bin_file.entries:
+        raise BinFormatError("BIN file has no entries")
+    entries = bin_file.entries
+    entries[0] = (title_key,) + entries[0][1:]
+    if resolver_key is not None:
+        layout = [(class_hash, i) for i, (_, class_hash, _) in enumerate(entries)]
+        for i in _resolver_offsets(layout):
+            entries[i] = (resolver_key,) + entries[i][1:]
+    return write_bin(bin_file)
+
+
+def ritobin_patch(scriptdir: str, base_bin: str, skin_bin: str) -> Tuple[bytes, Tuple[int, Optional[int]]]:
+    """Patch skin_bin with base_bin keys through the ritobin JSON round trip.
+
+    Returns the patched bytes and the (title, resolver) keys ritobin read
+    from the base skin.
+    """
+    import os
+    import shutil
+    import tempfile
+    from extractor import get_resource_resolver, read_json_file, run_ritobin, set_resource_resolver, write_json_file
+    from hashing import bin_key_to_hash
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        shutil.copy(base_bin, os.path.join(work_dir, "base.bin"))
+        shutil.copy(skin_bin, os.path.join(work_dir, "skin.bin"))
+        run_ritobin(scriptdir, os.path.join(work_dir, "base.bin"), "json")
+        run_ritobin(scriptdir, os.path.join(work_dir, "skin.bin"), "json")
+        base_json = read_json_file(os.path.join(work_dir, "base"))
+        skin_json = read_json_file(os.path.join(work_dir, "skin"))
+        json_title = base_json["entries"]["value"]["items"][0]["key"]
+        json_resolver = get_resource_resolver(base_json)
+        skin_json["entries"]["value"]["items"][0]["key"] = json_title
+        if json_resolver:
+            set_resource_resolver(skin_json, json_resolver)
+        write_json_file(os.path.join(work_dir, "patched"), skin_json)
+        run_ritobin(scriptdir, os.path.join(work_dir, "patched.json"), "bin")
+        with open(os.path.join(work_dir, "patched.bin"), "rb") as f:
+            patched = f.read()
+    return patched, (bin_key_to_hash(json_title), bin_key_to_hash(json_resolver) if json_resolver else None)
+
+
+def verify_against_ritobin(scriptdir: str, base_bin: str, skin_bin: str) -> Dict[str, bool]:
+    """Patch skin_bin with base_bin keys natively and through ritobin and compare the bytes."""
+    with open(base_bin, "rb") as f:
+        base_data = f.read()
+    with open(skin_bin, "rb") as f:
+        skin_data = f.read()
+    title_key, resolver_key = read_entry_keys(base_data)
+    expected, ritobin_keys = ritobin_patch(scriptdir, base_bin, skin_bin)
+    return {
+        "keys": ritobin_keys == (title_key, resolver_key),
+        "in_place": patch_entry_keys(skin_data, title_key, resolver_key) == expected,
+        "tree": patch_entry_keys_tree(skin_data, title_key, resolver_key) == expected,
+        "round_trip": write_bin(read_bin(skin_data)) == skin_data,
+    }
+
+
+if __name__ == "__main__":
+    import argparse
+    import os
+    from extractor import get_script_dir
+
+    parser = argparse.ArgumentParser(description="Compare native BIN patching with ritobin output")
+    parser.add_argument("base_bin")
+    parser.add_argument("skin_bins", nargs="+")
+    parser.add_argument("--golden", action="store_true",
+                        help="write ritobin's output next to each skin as <name>.patched.bin instead of comparing")
+    args = parser.parse_args()
+    failed = False
+    for path in args.skin_bins:
+        if args.golden:
+            patched, _ = ritobin_patch(get_script_dir(), args.base_bin, path)
+            golden = f"{os.path.splitext(path)[0]}.patched.bin"
+            with open(golden, "wb") as f:
+                f.write(patched)
+            print(path, "->", golden)
+            continue
+        result = verify_against_ritobin(get_script_dir(), args.base_bin, path)
+        failed = failed or not all(result.values())
+        print(path, result)
+    raise SystemExit(1 if failed else 0)
@@ -0,0 +1,111 @@
+import asyncio
+import logging
+import os
+import time
+from typing import Any, Dict, List
+
+from build_manifest import build_manifest
+from metrics import build_failures, build_queue_depth, builds_in_flight, stage_duration
+from extractor import process_character_directory, process_character_skins, get_script_dir
+from rebuild_scheduler import PRIORITY_ON_DEMAND, RebuildScheduler
+from skin_file_fetcher import download_champion_skins, download_skin
+
+logger = logging.getLogger(__name__)
+
+def cdn_file_path(script_dir: str, champ_id: str, skin_id: str) -> str:
+    return os.path.join(script_dir, "cdn", champ_id, f"{skin_id}.wad.client")
+
+
+def build_skin(api_version: str, champ_id: str, skin_id: str) -> str:
+    """Download and pack one skin archive, record it in the manifest and return its path in cdn/."""
+    script_dir = get_script_dir()
+    started = time.monotonic()
+    with stage_duration.time(stage="build"):
+        download_skin(champ_id, skin_id, api_version)
+        build_info = process_character_directory(script_dir, champ_id, skin_id, api_version)
+    if build_info is None:
+        build_failures.inc(stage="build")
+        raise RuntimeError(f"Build of {champ_id}/{skin_id} produced no archive")
+    build_manifest.record_build(
+        champ_id, skin_id, api_version, build_duration=time.monotonic() - started, **build_info
+    )
+    return cdn_file_path(script_dir, champ_id, skin_id)
+
+
+rebuild_scheduler = RebuildScheduler(
+    build_skin, max_workers=int(os.getenv("BUILD_WORKERS", min(4, os.cpu_count() or 1)))
+)
+builds_in_flight.set_function(lambda: rebuild_scheduler.status()["running"])
+build_queue_depth.set_function(lambda: rebuild_scheduler.status()["queued"])
+
+
+def build_champion(api_version: str, champ_id: str, skin_ids: List[str], max_workers: int = 4,
+                   scheduler: RebuildScheduler = None) -> Dict[str, Dict[str, Any]]:
+    """Download and pack several skins of one champion in one pass, recording each built one.
+
+    The skins are claimed on the scheduler first, so an on-demand build of
+    one of them waits for this batch instead of writing the same archive,
+    and skins the scheduler is already building are waited for instead.
+    Returns the per-skin report of process_character_skins.
+    """
+    scheduler = scheduler or rebuild_scheduler
+    script_dir = get_script_dir()
+    claimed, busy = scheduler.claim([(api_version, champ_id, skin_id) for skin_id in skin_ids])
+    wanted = [skin_id for _, _, skin_id in claimed]
+    report: Dict[str, Dict[str, Any]] = {}
+    started = time.monotonic()
+    try:
+        with stage_duration.time(stage="build_champion"):
+            downloaded = download_champion_skins(champ_id, wanted, api_version) if wanted else {}
+            report.update({skin_id: {"ok": False, "error": "download failed"}
+                           for skin_id, ok in downloaded.items() if not ok})
+            to_build = [skin_id for skin_id in wanted if skin_id not in report]
+            if to_build:
+                report.update(process_character_skins(script_dir, champ_id, to_build, api_version, max_workers))
+        # the batch shares its download and decode, so each skin is charged an equal share
+        duration = (time.monotonic() - started) / max(len(wanted), 1)
+        for skin_id in wanted:
+            result = report.setdefault(skin_id, {"ok": False, "error": "not built"})
+            if not result["ok"]:
+                build_failures.inc(stage="build")
+                continue
+            build_info = {key: value for key, value in result.items() if key != "ok"}
+            build_manifest.record_build(champ_id, skin_id, api_version, build_duration=duration, **build_info)
+    finally:
+        for key in claimed:
+            result = report.get(key[2])
+            if result is not None and result["ok"]:
+                scheduler.release(key, cdn_file_path(script_dir, champ_id, key[2]))
+            else:
+                error = result["error"] if result is not None else "batch build interrupted"
+                scheduler.release(key, error=RuntimeError(f"Build of {champ_id}/{key[2]} failed: {error}"))
+    for (_, _, skin_id), future in busy.items():
+        try:
+            future.result()
+            report[skin_id] = {"ok": True}
+        except Exception as e:
+            report[skin_id] = {"ok": False, "error": str(e)}
+    return report
+
+
+class BuildCoordinator:
+    """Awaitable front for cold skin builds, one build per (version, champ, skin).
+
+    Builds run on the rebuild scheduler's worker threads with on-demand
+    priority, and concurrent callers asking for a skin that is already queued
+    or building await the same future instead of starting another build.
+    """
+
+    def __init__(self, scheduler: RebuildScheduler):
+        self.scheduler = scheduler
+
+    async def build(self, api_version: str, champ_id: str, skin_id: str) -> str:
+        future = self.scheduler.submit(api_version, champ_id, skin_id, PRIORITY_ON_DEMAND)
+        # shield so one disconnecting client does not cancel the build for the others
+        return await asyncio.shield(asyncio.wrap_future(future))
+
+    def shutdown(self) -> None:
+        self.scheduler.shutdown()
+
+
+build_coordinator = BuildCoordinator(rebuild_scheduler)
@@ -0,0 +1,154 @@
+import datetime
+import json
+import logging
+import os
+import pickle
+import threading
+from typing import Dict, List, Optional, Tuple
+
+from sqlmodel import Session, select
+
+from extractor import get_script_dir
+from models.models import BuildRecord, CatalogState, engine
+from wad_writer import wad_content_hash
+
+logger = logging.getLogger(__name__)
+
+ManifestKey = Tuple[str, str]
+
+
+class BuildManifest:
+    """Per-archive build records, one row per (champion, skin) in SQLite.
+
+    Every build writes its row as soon as it finishes, and all rows are
+    mirrored in an in-memory dict so request-path lookups never touch the
+    database or the filesystem.
+    """
+
+    def __init__(self, legacy_cache: str = None):
+        self.legacy_cache = legacy_cache or os.path.join(os.path.dirname(os.path.abspath(__file__)), "cache.bin")
+        self.lock = threading.Lock()
+        self.records: Optional[Dict[ManifestKey, BuildRecord]] = None
+
+    def _ensure_loaded(self) -> Dict[ManifestKey, BuildRecord]:
+        if self.records is not None:
+            return self.records
+        with self.lock:
+            if self.records is None:
+                with Session(engine) as db:
+                    rows = db.exec(select(BuildRecord)).all()
+                    if not rows and db.get(CatalogState, "legacy_cache_imported") is None:
+                        rows = self._import_legacy_cache(db)
+                self.records = {(row.champion_id, row.skin_id): row for row in rows}
+        return self.records
+
+    def _import_legacy_cache(self, db: Session) -> List[BuildRecord]:
+        """One-time import of the pickled cache.bin version map."""
+        try:
+            with open(self.legacy_cache, "rb") as f:
+                legacy: Dict[str, Tuple[str, datetime.datetime]] = pickle.load(f)
+        except (pickle.UnpicklingError, EOFError, FileNotFoundError, IsADirectoryError):
+            legacy = {}
+        rows = []
+        skipped = 0
+        cdn_dir = os.path.join(get_script_dir(), "cdn")
+        for key, (version, updated) in legacy.items():
+            champ_id, skin_id = key.split("_", 1)
+            # cache.bin also recorded builds that failed, those never produced an archive
+            if not os.path.exists(os.path.join(cdn_dir, champ_id, f"{skin_id}.wad.client")):
+                skipped += 1
+                continue
+            rows.append(BuildRecord(champion_id=champ_id, skin_id=skin_id, version=version, built_at=updated))
+        db.add_all(rows)
+        db.add(CatalogState(key="legacy_cache_imported", value=datetime.datetime.utcnow().isoformat()))
+        db.commit()
+        for row in rows:
+            db.refresh(row)
+        logger.info(f"Imported {len(rows)} entries from {self.legacy_cache}, skipped {skipped} without an archive")
+        return rows
+
+    def get(self, champ_id: str, skin_id: str) -> Optional[BuildRecord]:
+        return self._ensure_loaded().get((champ_id, skin_id))
+
+    def reload(self) -> int:
+        """Re-read every row, picking up builds other processes (prebuild) recorded."""
+        with self.lock:
+            with Session(engine) as db:
+                rows = db.exec(select(BuildRecord)).all()
+            self.records = {(row.champion_id, row.skin_id): row for row in rows}
+        return len(rows)
+
+    def all(self) -> List[BuildRecord]:
+        return list(self._ensure_loaded().values())
+
+    def record_build(self, champ_id: str, skin_id: str, version: str, size: int = 0,
+                     content_hash: Optional[str] = None, source_hashes: Optional[Dict[str, str]] = None,
+                     build_duration: float = 0.0) -> BuildRecord:
+        records = self._ensure_loaded()
+        record = BuildRecord(
+            champion_id=champ_id,
+            skin_id=skin_id,
+            version=version,
+            size=size,
+            content_hash=content_hash,
+            source_hashes=json.dumps(source_hashes or {}, sort_keys=True),
+            build_duration=build_duration,
+            built_at=datetime.datetime.utcnow(),
+        )
+        with self.lock:
+            with Session(engine) as db:
+                record = db.merge(record)
+                db.commit()
+                db.refresh(record)
+                db.expunge(record)
+            records[(champ_id, skin_id)] = record
+        return record
+
+    def retag(self, keys: List[ManifestKey], version: str) -> int:
+        """Move archives whose sources did not change to a new game version without rebuilding them."""
+        records = self._ensure_loaded()
+        retagged = []
+        with self.lock:
+            with Session(engine) as db:
+                for key in keys:
+                    record = db.get(BuildRecord, key)
+                    if record is not None:
+                        record.version = version
+                        db.add(record)
+                        retagged.append(record)
+                db.commit()
+                for record in retagged:
+                    db.refresh(record)
+                    db.expunge(record)
+                    records[(record.champion_id, record.skin_id)] = record
+        return len(retagged)
+
+    def adopt(self, champ_id: str, skin_id: str, path: str, version: str = "") -> BuildRecord:
+        """Record an archive that exists in cdn/ but is missing from the in-memory mirror.
+
+        A row written since the mirror was loaded, e.g. by a prebuild run, is
+        loaded as is; only an archive without any row gets a new record.
+        """
+        records = self._ensure_loaded()
+        with self.lock:
+            with Session(engine) as db:
+                record = db.get(BuildRecord, (champ_id, skin_id))
+                if record is not None:
+                    db.expunge(record)
+                    records[(champ_id, skin_id)] = record
+        if record is not None:
+            return record
+        return self.record_build(champ_id, skin_id, version, os.path.getsize(path), wad_content_hash(path))
+
+    def remove(self, champ_id: str, skin_id: str) -> None:
+        records = self._ensure_loaded()
+        with self.lock:
+            with Session(engine) as db:
+                record = db.get(BuildRecord, (champ_id, skin_id))
+                if record is not None:
+                    db.delete(record)
+                    db.commit()
+            records.pop((champ_id, skin_id), None)
+
+
+build_manifest = BuildManifest()
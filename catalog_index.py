@@ -0,0 +1,56 @@
+import logging
+import threading
+from typing import List, NamedTuple, Optional
+
+from sqlmodel import Session, select
+
+from models.models import Champion, Skin, engine
+
+logger = logging.getLogger(__name__)
+
+
+class CatalogSkin(NamedTuple):
+    champion_id: str
+    champ_name: str
+    skin_id: str
+    skin_name: str
+
+
+class CatalogIndex:
+    """In-memory copy of the skin catalog with champion and skin names.
+
+    Loaded from the database in two queries on first use and kept until
+    invalidate() is called, which happens whenever seed_database reports
+    that the catalog changed, so the hourly update job reads it without
+    touching the database.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.catalog: Optional[List[CatalogSkin]] = None
+
+    def _ensure_loaded(self) -> List[CatalogSkin]:
+        catalog = self.catalog
+        if catalog is not None:
+            return catalog
+        with self.lock:
+            if self.catalog is None:
+                with Session(engine) as db:
+                    names = {champ.id: champ.champ_name for champ in db.exec(select(Champion)).all()}
+                    skins = db.exec(select(Skin)).all()
+                self.catalog = [
+                    CatalogSkin(skin.champion_id, names.get(skin.champion_id), skin.id, skin.skin_name)
+                    for skin in skins
+                ]
+                logger.info(f"Catalog index loaded with {len(self.catalog)} skins")
+            return self.catalog
+
+    def invalidate(self) -> None:
+        with self.lock:
+            self.catalog = None
+
+    def skins(self) -> List[CatalogSkin]:
+        return list(self._ensure_loaded())
+
+
+catalog_index = CatalogIndex()
@@ -0,0 +1,68 @@
+import threading
+from typing import Dict, Optional
+
+from sqlmodel import Session
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from metrics import cache_result
+from models.models import Champion, async_engine, engine
+
+
+class CatalogReads:
+    """Cached, read-only champion lookups for the request path.
+
+    Async helpers query through the aiosqlite engine so request handlers
+    never block the event loop, and WAL mode keeps them from waiting on the
+    background catalog sync. Rows are cached until invalidate() is called
+    after a sync that changed the catalog; callers must not modify them.
+    Misses are not cached, so ids sent by clients cannot grow the cache
+    past the size of the catalog.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.champions: Dict[str, Champion] = {}
+        self.generation = 0
+
+    def _remember(self, cache: dict, key: str, value, generation: int) -> None:
+        if value is None:
+            return
+        with self.lock:
+            # a result read before an invalidate() must not repopulate the cache
+            if generation == self.generation:
+                cache[key] = value
+
+    def _cached(self, cache: dict, key: str):
+        with self.lock:
+            hit = key in cache
+            value = cache.get(key)
+            generation = self.generation
+        cache_result("catalog_reads", hit)
+        return hit, value, generation
+
+    async def champion(self, champ_id: str) -> Optional[Champion]:
+        hit, champion, generation = self._cached(self.champions, champ_id)
+        if hit:
+            return champion
+        async with AsyncSession(async_engine, expire_on_commit=False) as db:
+            champion = await db.get(Champion, champ_id)
+        self._remember(self.champions, champ_id, champion, generation)
+        return champion
+
+    def champion_sync(self, champ_id: str) -> Optional[Champion]:
+        """Same as champion() for build threads, through the sync engine."""
+        hit, champion, generation = self._cached(self.champions, champ_id)
+        if hit:
+            return champion
+        with Session(engine, expire_on_commit=False) as db:
+            champion = db.get(Champion, champ_id)
+        self._remember(self.champions, champ_id, champion, generation)
+        return champion
+
+    def invalidate(self) -> None:
+        with self.lock:
+            self.champions.clear()
+            self.generation += 1
+
+
+catalog_reads = CatalogReads()
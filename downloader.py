@@ -0,0 +1,161 @@
+import asyncio
+import json
+import logging
+import os
+import tempfile
+import threading
+from typing import List, Optional, Sequence, Tuple
+
+from urllib.parse import urlparse
+
+from aiohttp import ClientError, ClientSession, ClientTimeout, TCPConnector
+
+from metrics import stage_bytes, upstream_responses
+
+logger = logging.getLogger(__name__)
+
+DownloadJob = Tuple[Sequence[str], str]
+
+
+class SkinDownloader:
+    """Async download engine shared by every build.
+
+    A single aiohttp session with a bounded connection pool lives on its own
+    event loop thread, so synchronous build threads can hand it batches of
+    files and block until the whole batch is on disk. Files are streamed to a
+    temp file and only renamed into place once complete; the ETag and
+    Last-Modified of every download are kept in a "<file>.meta" sidecar and
+    sent back on the next request for the same file.
+    """
+
+    def __init__(self, limit: int = None, limit_per_host: int = None, chunk_size: int = 64 * 1024):
+        self.limit = limit or int(os.getenv("DOWNLOAD_CONCURRENCY", 32))
+        self.limit_per_host = limit_per_host or int(os.getenv("DOWNLOAD_CONCURRENCY_PER_HOST", 8))
+        self.chunk_size = chunk_size
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self.session: Optional[ClientSession] = None
+        self.lock = threading.Lock()
+
+    def _ensure_started(self) -> asyncio.AbstractEventLoop:
+        with self.lock:
+            if self.loop is None:
+                loop = asyncio.new_event_loop()
+                threading.Thread(target=loop.run_forever, name="skin-downloader", daemon=True).start()
+                self.session = asyncio.run_coroutine_threadsafe(self._create_session(), loop).result()
+                self.loop = loop
+            return self.loop
+
+    async def _create_session(self) -> ClientSession:
+        return ClientSession(
+            connector=TCPConnector(limit=self.limit, limit_per_host=self.limit_per_host),
+            timeout=ClientTimeout(total=120, sock_connect=10),
+        )
+
+    def download_many(self, jobs: List[DownloadJob]) -> List[bool]:
+        """Download every (candidate urls, destination) job concurrently, blocking until done."""
+        loop = self._ensure_started()
+        return asyncio.run_coroutine_threadsafe(self._download_many(jobs), loop).result()
+
+    async def _download_many(self, jobs: List[DownloadJob]) -> List[bool]:
+        return list(await asyncio.gather(*(self.fetch_to_file(urls, dest) for urls, dest in jobs)))
+
+    def head_many(self, candidates: List[Sequence[str]]) -> List[Optional[Tuple[str, Optional[str]]]]:
+        """Resolve each list of candidate urls with HEAD requests, blocking until done.
+
+        Returns the first url that exists and its ETag, or None when none
+        exists or the check failed.
+        """
+        loop = self._ensure_started()
+        return asyncio.run_coroutine_threadsafe(self._head_many(candidates), loop).result()
+
+    async def _head_many(self, candidates: List[Sequence[str]]) -> List[Optional[Tuple[str, Optional[str]]]]:
+        return list(await asyncio.gather(*(self.head(urls) for urls in candidates)))
+
+    async def head(self, urls: Sequence[str]) -> Optional[Tuple[str, Optional[str]]]:
+        for url in urls:
+            try:
+                async with self.session.head(url, allow_redirects=True) as response:
+                    upstream_responses.inc(upstream=urlparse(url).netloc, status=response.status)
+                    if response.status == 404:
+                        continue
+                    if response.status >= 400:
+                        return None
+                    return url, response.headers.get("ETag")
+            except (ClientError, asyncio.TimeoutError) as e:
+                logger.warning(f"HEAD {url} failed: {e}")
+                return None
+        return None
+
+    @staticmethod
+    def _read_meta(dest: str) -> dict:
+        try:
+            with open(f"{dest}.meta", "r") as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
+
+    async def fetch_to_file(self, urls: Sequence[str], dest: str, max_retries: int = 3) -> bool:
+        """Fetch the first url that exists into dest; later urls are fallbacks for 404s."""
+        dest = str(dest)
+        meta = self._read_meta(dest) if os.path.exists(dest) else {}
+        for url in urls:
+            headers = {}
+            if meta.get("url") == url:
+                if meta.get("etag"):
+                    headers["If-None-Match"] = meta["etag"]
+                if meta.get("last_modified"):
+                    headers["If-Modified-Since"] = meta["last_modified"]
+            for attempt in range(max_retries):
+                try:
+                    async with self.session.get(url, headers=headers) as response:
+                        upstream_responses.inc(upstream=urlparse(url).netloc, status=response.status)
+                        if response.status == 304:
+                            return True
+                        if response.status == 404:
+                            break
+                        response.raise_for_status()
+                        await self._stream_to_file(response, dest)
+                        with open(f"{dest}.meta", "w") as f:
+                            json.dump({
+                                "url": url,
+                                "etag": response.headers.get("ETag"),
+                                "last_modified": response.headers.get("Last-Modified"),
+                            }, f)
+                        return True
+                except (ClientError, asyncio.TimeoutError, OSError) as e:
+                    logger.warning(f"Attempt {attempt + 1} for {url} failed: {e}")
+                    await asyncio.sleep(0.5 * 2 ** attempt)
+            else:
+                logger.error(f"Final attempt failed for {url}")
+                continue
+            logger.warning(f"{url} not found")
+        return False
+
+    async def _stream_to_file(self, response, dest: str) -> None:
+        dest_dir = os.path.dirname(dest) or "."
+        os.makedirs(dest_dir, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=dest_dir, prefix=".", suffix=".part")
+        size = 0
+        try:
+            with os.fdopen(fd, "wb") as f:
+                async for chunk in response.content.iter_chunked(self.chunk_size):
+                    f.write(chunk)
+                    size += len(chunk)
+            os.replace(tmp_path, dest)
+            stage_bytes.observe(size, stage="download")
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def close(self) -> None:
+        with self.lock:
+            if self.loop is None:
+                return
+            asyncio.run_coroutine_threadsafe(self.session.close(), self.loop).result()
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            self.loop = None
+            self.session = None
+
+
+skin_downloader = SkinDownloader()
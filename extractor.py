@@ -1,19 +1,23 @@
+import hashlib
 import logging
 import os
 import subprocess
+import tempfile
 from concurrent.futures import ThreadPoolExecutor
 logger = logging.getLogger(__name__)
 import json
 import shutil
-from sys import api_version
-from typing import Dict, Any, Optional, List
-from models.models import getApiVersion
+from typing import Dict, Any, Optional, List, Tuple
+from base_skin_cache import SOURCE_NAMES as BASE_SOURCE_NAMES, base_skin_cache
+from bin_codec import RESOURCE_RESOLVER_HASH, BinFormatError, read_entry_keys, patch_entry_keys
+from hash_index import hash_indexes
+from hashing import bin_key_to_hash
+from wad_writer import write_wad
+from metrics import build_failures, cache_result, stage_bytes, stage_duration
 from dotenv import load_dotenv
 from concurrent.futures import as_completed
 
 load_dotenv("./.env")
-api_version = getApiVersion()
-api_version = api_version[:-2]
 
 
 def get_script_dir():
@@ -26,11 +30,6 @@ def rito_bin_executer(script_dir:str) -> str:
         return os.path.join(script_dir,"ritobin.exe")
     else:
         return os.path.join(script_dir,"linux_binaries","ritobin_cli")
-def wad_make_exectuor(script_dir:str) -> str:
-    if os.environ.get("Environment") == "Development":
-        return os.path.join(script_dir,"wad-make.exe")
-    else:
-        return os.path.join(script_dir,"linux_binaries","wad-make")
 def run_process(cmd: List[str], timeout: float = 60.0):
     try:
         result = subprocess.run(
@@ -44,11 +43,18 @@ def run_process(cmd: List[str], timeout: float = 60.0):
     except subprocess.CalledProcessError as e:
         raise e
 def run_ritobin(scriptdir: str, filename: str, output_extension: str):
-    cmd = [filename, "-o", output_extension]
+    # -k keeps names hashed, so ritobin never parses the hash text tables into its heap;
+    # names are resolved from the mmap index (hash_index) when needed
+    cmd = [filename, "-k", "-o", output_extension]
     exe = rito_bin_executer(scriptdir)
     if exe:
         cmd.insert(0, exe)
-    run_process(cmd)
+    try:
+        with stage_duration.time(stage="ritobin"):
+            run_process(cmd)
+    except Exception:
+        build_failures.inc(stage="ritobin")
+        raise
 
 
 def read_json_file(filename: str) -> Dict[str, Any]:
@@ -67,167 +73,309 @@ def write_json_file(filename: str, data: Dict[str, Any]) -> None:
         json.dump(data, writefile, indent=2)
 
 
+def is_resource_resolver(item: Dict[str, Any]) -> bool:
+    """Whether a ritobin JSON entry is the ResourceResolver, its class name hashed or not."""
+    return bin_key_to_hash(item["value"]["name"]) == RESOURCE_RESOLVER_HASH
+
+
 def get_resource_resolver(data: Dict[str, Any]) -> Optional[str]:
     """Extract the ResourceResolver key from skin data."""
     items = data["entries"]["value"]["items"]
-    if items[-1]["value"]["name"] == "ResourceResolver":
+    if is_resource_resolver(items[-1]):
         return items[-1]["key"]
 
     for obj in items:
-        if obj["value"]["name"] == "ResourceResolver":
+        if is_resource_resolver(obj):
             return obj["key"]
     return None
 
 
-def process_skin_folder_wrapper(args: tuple) -> None:
+def set_resource_resolver(data: Dict[str, Any], key: str) -> None:
+    """Point the ResourceResolver entry (the trailing one when it is last) at key."""
+    items = data["entries"]["value"]["items"]
+    if is_resource_resolver(items[-1]):
+        items[-1]["key"] = key
+    else:
+        for obj in items:
+            if is_resource_resolver(obj):
+                obj["key"] = key
+
+
+def process_skin_folder_wrapper(args: tuple) -> Optional[Tuple[str, bytes]]:
     """Wrapper for skin folder processing. using multithreading"""
     scriptdir, champion_key, folder_path, skin_number = args
-    process_skin_folder(scriptdir, champion_key, folder_path, skin_number)
-
-
-def process_skin_folder(scriptdir: str, championkey: str, folder_path: str, skin_number: str) -> None:
-    """Process a skin folder containing skin and animation files."""
-    base_skin = 0
-    os.path.join(folder_path, )
-    # Process base skin first if it exists
-    if not os.path.exists(os.path.join(folder_path, "skinbase.json")
-                          ) and os.path.exists(os.path.join(folder_path, f"skin{base_skin}.bin")
-                                               ):
-        try:
-            run_ritobin(scriptdir, os.path.join(folder_path, f"skin{base_skin}.bin")
-                        , "json")
-            shutil.copy(os.path.join(folder_path, f"skin{base_skin}.json"), os.path.join(folder_path, "skinbase.json"))
-        except subprocess.CalledProcessError as e:
-            logger.error(f"Error processing base skin: {e}")
-            return
-    # Load base data
-    base_data = (
-        read_json_file(os.path.join(folder_path, "skinbase"))
-        if os.path.exists(os.path.join(folder_path, "skinbase.json"))
-        else read_json_file(os.path.join(folder_path, f"skin{base_skin}"))
-    )
-    base_skin_title = base_data["entries"]["value"]["items"][0]["key"]
-    base_skin_resources = get_resource_resolver(base_data)
-    original_skin_number = skin_number
+    return process_skin_folder(scriptdir, champion_key, folder_path, skin_number)
+
+
+def skin_wad_path(folder_path: str) -> str:
+    """Virtual path of the patched skin0.bin of a character folder inside the archive."""
+    return f"data/characters/{os.path.basename(folder_path)}/skins/skin0.bin"
+
+
+def get_base_skin_keys(folder_path: str) -> Tuple[int, Optional[int]]:
+    """Return the (title, ResourceResolver) entry keys of the untouched base skin."""
+    cached = base_skin_cache.lookup(folder_path)
+    cache_result("base_skin_keys", "title" in cached)
+    if "title" in cached:
+        return cached["title"], cached["resolver"]
+    base_bin = os.path.join(folder_path, "skinbase.bin")
+    base_json = os.path.join(folder_path, "skinbase.json")
+    if not os.path.exists(base_bin) and os.path.exists(base_json):
+        # skin0.bin of older folders is already overwritten, the json holds the original keys
+        base_data = read_json_file(base_json[:-5])
+        resolver = get_resource_resolver(base_data)
+        keys = (
+            bin_key_to_hash(base_data["entries"]["value"]["items"][0]["key"]),
+            bin_key_to_hash(resolver) if resolver else None,
+        )
+    else:
+        skin0_bin = os.path.join(folder_path, "skin0.bin")
+        if os.path.exists(skin0_bin):
+            # the keys are missing or skin0.bin changed since they were cached: (re)take a
+            # pristine copy of the downloaded base skin, written atomically
+            fd, tmp_path = tempfile.mkstemp(dir=folder_path, prefix=".", suffix=".tmp")
+            os.close(fd)
+            shutil.copy(skin0_bin, tmp_path)
+            os.replace(tmp_path, base_bin)
+        with open(base_bin, "rb") as f:
+            keys = read_entry_keys(f.read())
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug(f"Base keys of {folder_path}: title {hash_indexes.describe(keys[0])}, "
+                     f"resolver {hash_indexes.describe(keys[1]) if keys[1] is not None else None}")
+    base_skin_cache.store(folder_path, title=keys[0], resolver=keys[1])
+    return keys
+
 
+def patch_skin_folder_native(folder_path: str, skin_number: str) -> Optional[bytes]:
+    """Patch skin{N}.bin with the base skin keys in-process and return the new skin0.bin."""
+    skin_path = os.path.join(folder_path, f"skin{skin_number}.bin")
+    if not os.path.exists(skin_path):
+        base_path = pristine_base_skin(folder_path)
+        if not os.path.exists(base_path):
+            return None
+        with open(base_path, "rb") as f:
+            return f.read()
+    title_key, resolver_key = get_base_skin_keys(folder_path)
+    with open(skin_path, "rb") as f:
+        return patch_entry_keys(f.read(), title_key, resolver_key)
+
+
+def process_skin_folder(scriptdir: str, championkey: str, folder_path: str, skin_number: str) -> Optional[Tuple[str, bytes]]:
+    """Process a skin folder and return the archive path and bytes of its patched skin0.bin."""
     try:
-        logger.info(f"Processing {os.path.basename(os.getcwd())}/{skin_number}...")
-        if os.path.exists(os.path.join(folder_path, f"skin{skin_number}.bin")):
-            run_ritobin(scriptdir, os.path.join(folder_path, f"skin{skin_number}.bin"), "json")
-
-            # Load and modify skin data
-            json_file = os.path.join(folder_path, f"skin{skin_number}.json")
-            if os.path.exists(json_file):
-                skin_data = read_json_file(json_file[:-5])  # Remove .json extension
+        with stage_duration.time(stage="patch_native"):
+            patched = patch_skin_folder_native(folder_path, skin_number)
+        if patched is not None:
+            return skin_wad_path(folder_path), patched
+    except (BinFormatError, OSError, KeyError, json.JSONDecodeError) as e:
+        build_failures.inc(stage="patch_native")
+        logger.warning(f"Native BIN patch failed for {folder_path}, falling back to ritobin: {e}")
+    return process_skin_folder_ritobin(scriptdir, championkey, folder_path, skin_number)
+
+
+def scratch_workspace() -> tempfile.TemporaryDirectory:
+    """Private, self-cleaning work directory for one build (on tmpfs when available)."""
+    scratch_dir = os.getenv("SCRATCH_DIR")
+    if scratch_dir is None and os.access("/dev/shm", os.W_OK):
+        scratch_dir = "/dev/shm"
+    return tempfile.TemporaryDirectory(prefix="skinbuild-", dir=scratch_dir)
+
+
+def link_or_copy(src: str, dst: str) -> None:
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copy(src, dst)
+
+
+def pristine_base_skin(folder_path: str) -> str:
+    """Path of the unmodified base skin of a character folder."""
+    base_bin = os.path.join(folder_path, "skinbase.bin")
+    return base_bin if os.path.exists(base_bin) else os.path.join(folder_path, "skin0.bin")
+
+
+def process_skin_folder_ritobin(scriptdir: str, championkey: str, folder_path: str, skin_number: str) -> Optional[Tuple[str, bytes]]:
+    """Process a skin folder through the ritobin BIN->JSON->BIN round trip.
+
+    ritobin only ever runs on copies inside a scratch workspace, the shared
+    base folder is read-only here.
+    """
+    skin_path = os.path.join(folder_path, f"skin{skin_number}.bin")
+    try:
+        with scratch_workspace() as work_dir:
+            cached = base_skin_cache.lookup(folder_path)
+            cache_result("base_skin_json_keys", "json_title" in cached)
+            if "json_title" in cached:
+                base_skin_title = cached["json_title"]
+                base_skin_resources = cached["json_resolver"]
+            else:
+                # Load base data, older folders keep the converted base skin as skinbase.json
+                if os.path.exists(os.path.join(folder_path, "skinbase.json")):
+                    base_data = read_json_file(os.path.join(folder_path, "skinbase"))
+                else:
+                    link_or_copy(pristine_base_skin(folder_path), os.path.join(work_dir, "skinbase.bin"))
+                    run_ritobin(scriptdir, os.path.join(work_dir, "skinbase.bin"), "json")
+                    base_data = read_json_file(os.path.join(work_dir, "skinbase"))
+                base_skin_title = base_data["entries"]["value"]["items"][0]["key"]
+                base_skin_resources = get_resource_resolver(base_data)
+                base_skin_cache.store(folder_path, json_title=base_skin_title, json_resolver=base_skin_resources)
+
+            logger.info(f"Processing {os.path.basename(folder_path)}/{skin_number}...")
+            if not os.path.exists(skin_path):
+                with open(pristine_base_skin(folder_path), "rb") as f:
+                    return skin_wad_path(folder_path), f.read()
+
+            link_or_copy(skin_path, os.path.join(work_dir, "skin.bin"))
+            run_ritobin(scriptdir, os.path.join(work_dir, "skin.bin"), "json")
+
+            with stage_duration.time(stage="json_patch"):
+                # Load and modify skin data
+                skin_data = read_json_file(os.path.join(work_dir, "skin"))
                 skin_data["entries"]["value"]["items"][0]["key"] = base_skin_title
 
                 if base_skin_resources:
-                    items = skin_data["entries"]["value"]["items"]
-                    if items[-1]["value"]["name"] == "ResourceResolver":
-                        items[-1]["key"] = base_skin_resources
-                    else:
-                        for obj in items:
-                            if obj["value"]["name"] == "ResourceResolver":
-                                obj["key"] = base_skin_resources
-
-                # Write modified data to base skin and convert back to bin
-                write_json_file(os.path.join(folder_path, f"skin{base_skin}"), skin_data)
-                run_ritobin(scriptdir, os.path.join(folder_path, f"skin{base_skin}.json"), "bin")
-                os.remove(json_file)
-                os.remove(os.path.join(folder_path, "skin0.json"))
-                parent_dir_name = os.path.basename(folder_path)
-
-        write_modified_skin_to_output_dir(
-            scriptdir, championkey, parent_dir_name, original_skin_number, folder_path
-        )
-        # Clean up temporary files
+                    set_resource_resolver(skin_data, base_skin_resources)
+
+                # Write modified data as the new skin0 and convert back to bin
+                write_json_file(os.path.join(work_dir, "skin0"), skin_data)
+            run_ritobin(scriptdir, os.path.join(work_dir, "skin0.json"), "bin")
+            with open(os.path.join(work_dir, "skin0.bin"), "rb") as f:
+                return skin_wad_path(folder_path), f.read()
 
     except (
             FileNotFoundError,
             json.JSONDecodeError,
             subprocess.CalledProcessError,
     ) as e:
+        build_failures.inc(stage="ritobin_patch")
         logger.error(f"Error processing {skin_number}: {e}")
+        return None
 
 
-def process_character_directory(scriptdir: str, champion_key: str, skin_number: str, apiVersion: str) -> None:
-    """Process a character directory containing skin and animation folders."""
-    char_dir = f"{scriptdir}/base_skinsfiles/{apiVersion}/{champion_key}"
-    if not os.path.exists(char_dir):
-        logger.error("Path does not exist!")
-    skin_folders = [
+def file_sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def source_file_hashes(folder_path: str, skin_number: str) -> Dict[str, str]:
+    """Hash the downloaded inputs of one character folder (pristine skin0 and skinN)."""
+    folder = os.path.basename(folder_path)
+    hashes = {}
+    for name, path in (("skin0.bin", pristine_base_skin(folder_path)), (f"skin{skin_number}.bin", os.path.join(folder_path, f"skin{skin_number}.bin"))):
+        if os.path.exists(path):
+            hashes[f"{folder}/{name}"] = file_sha256(path)
+    return hashes
+
+
+def character_folders(char_dir: str) -> List[str]:
+    """Character folders (the champion and its summons/animations) of a champion directory.
+
+    Folders the index matched but that hold no base skin have nothing to build and are left out.
+    """
+    return [
         os.path.join(char_dir, folder)
         for folder in os.listdir(char_dir)
         if os.path.isdir(os.path.join(char_dir, folder))
+        and any(os.path.exists(os.path.join(char_dir, folder, name)) for name in BASE_SOURCE_NAMES)
     ]
+
+
+def pack_skin(scriptdir: str, champion_key: str, skin_number: str, skin_folders: List[str],
+              wad_entries: List[Tuple[str, bytes]]) -> Optional[Dict[str, Any]]:
+    """Write the patched entries of one skin to cdn/ and return its build info."""
+    if not wad_entries:
+        build_failures.inc(stage="package")
+        logger.error(f"No skin files produced for {champion_key}/{skin_number}")
+        return None
+    source_hashes = {}
+    for folder in skin_folders:
+        source_hashes.update(source_file_hashes(folder, skin_number))
+    with open(os.path.join(scriptdir, "info.json"), "rb") as f:
+        wad_entries.append(("Meta/info.json", f.read()))
+    size, content_hash = write_to_server_cdn(scriptdir, wad_entries, champion_key, skin_number)
+    return {"size": size, "content_hash": content_hash, "source_hashes": source_hashes}
+
+
+def process_character_directory(scriptdir: str, champion_key: str, skin_number: str, apiVersion: str) -> Optional[Dict[str, Any]]:
+    """Process a character directory containing skin and animation folders.
+
+    Returns the size, content hash and source file hashes of the written
+    archive, or None when nothing could be built.
+    """
+    char_dir = f"{scriptdir}/base_skinsfiles/{apiVersion}/{champion_key}"
+    if not os.path.exists(char_dir):
+        logger.error("Path does not exist!")
+    skin_folders = character_folders(char_dir)
     args_list = [(scriptdir, champion_key, folder, skin_number) for folder in skin_folders]
 
+    wad_entries = []
     with ThreadPoolExecutor(max_workers=4) as executor:
         futures = [executor.submit(process_skin_folder_wrapper, args) for args in args_list]
         for future in as_completed(futures):
             try:
-                future.result()
+                entry = future.result()
+                if entry:
+                    wad_entries.append(entry)
             except Exception as e:
                 logger.error(f"Error in processing skin folder: {e}")
-    archive_source = os.path.join(
-        scriptdir,
-        "output",
-        api_version,
-        champion_key,
-        skin_number,
-    )
-    info = os.path.join(archive_source, "Meta")
-    if not os.path.exists(info):
-        os.makedirs(info)
-    shutil.copy(os.path.join(scriptdir, "info.json"), info)
-    write_to_server_cdn(scriptdir, archive_source, champion_key, skin_number)
-
-
-def write_modified_skin_to_output_dir(scriptdir: str, champ_key: str, champ_name: str, skin_num: str, folder_path: str):
-    try:
-        output_dir = os.path.join(
-            scriptdir,
-            "output",
-            api_version,
-            champ_key,
-            skin_num,
-            "data",
-            "characters",
-            champ_name
-            , "skins"
-        )
-        # archive_source = os.path.join(
-        #     scriptdir,
-        #     "output",
-        #     api_version,
-        #     champ_key,
-        #     skin_num,
-        # )
-        if not os.path.exists(output_dir):
-            os.makedirs(output_dir)
-        if not os.path.exists(os.path.join(folder_path, f"skin0.bin")):
-            logger.error(f"Error: Could not find skin0.bin in {folder_path}")
-            return
-        if not os.path.exists(os.path.join(output_dir, f"skin0.bin")):
-            shutil.copy(
-                os.path.join(folder_path, f"skin0.bin"), os.path.join(output_dir, f"skin0.bin")
-            )
-        # info = os.path.join(archive_source, "Meta")
-        # if not os.path.exists(info):
-        #     os.makedirs(info)
-        # shutil.copy(os.path.join(scriptdir, "info.json"), info)
-        # write_to_server_cdn(scriptdir, archive_source, champ_key, skin_num)
-        return
-    except Exception as error:
-        logger.error(error)
-
-
-def write_to_server_cdn(base_dir: str, dir: str, champKey: str, skinNum: str):
+    return pack_skin(scriptdir, champion_key, skin_number, skin_folders, wad_entries)
+
+
+def process_character_skins(scriptdir: str, champion_key: str, skin_numbers: List[str], apiVersion: str,
+                            max_workers: int = 4) -> Dict[str, Dict[str, Any]]:
+    """Build several skins of one champion in a single pass over its character directory.
+
+    The folders are scanned and every base skin is decoded once, then each
+    skin is patched and packed on its own worker. Returns a report keyed by
+    skin number: {"ok": True, **build info} or {"ok": False, "error": ...}.
+    """
+    char_dir = f"{scriptdir}/base_skinsfiles/{apiVersion}/{champion_key}"
+    if not os.path.isdir(char_dir):
+        logger.error(f"Path does not exist: {char_dir}")
+        return {skin_number: {"ok": False, "error": "character directory missing"} for skin_number in skin_numbers}
+    skin_folders = character_folders(char_dir)
+    with stage_duration.time(stage="base_decode"):
+        for folder in skin_folders:
+            try:
+                get_base_skin_keys(folder)
+            except (BinFormatError, OSError, KeyError, json.JSONDecodeError) as e:
+                # the ritobin fallback decodes this folder on its own
+                logger.warning(f"Could not decode base skin of {folder}: {e}")
+
+    def build_one(skin_number: str) -> Optional[Dict[str, Any]]:
+        wad_entries = []
+        for folder in skin_folders:
+            entry = process_skin_folder(scriptdir, champion_key, folder, skin_number)
+            if entry:
+                wad_entries.append(entry)
+        return pack_skin(scriptdir, champion_key, skin_number, skin_folders, wad_entries)
+
+    report = {}
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(skin_numbers)))) as executor:
+        futures = {executor.submit(build_one, skin_number): skin_number for skin_number in skin_numbers}
+        for future in as_completed(futures):
+            skin_number = futures[future]
+            try:
+                build_info = future.result()
+            except Exception as e:
+                build_failures.inc(stage="package")
+                logger.error(f"Error building {champion_key}/{skin_number}: {e}")
+                report[skin_number] = {"ok": False, "error": str(e)}
+                continue
+            if build_info is None:
+                report[skin_number] = {"ok": False, "error": "no skin files produced"}
+            else:
+                report[skin_number] = {"ok": True, **build_info}
+    return report
+
+
+def write_to_server_cdn(base_dir: str, entries: List[Tuple[str, bytes]], champKey: str, skinNum: str) -> Tuple[int, str]:
     output_path = os.path.join(base_dir, "cdn", champKey, skinNum)
     output_file = f"{output_path}.wad.client"
-
-    cmd = [dir, output_file]
-    exe = wad_make_exectuor(base_dir)
-    if exe:
-        cmd.insert(0, exe)
-    run_process(cmd)
\ No newline at end of file
+    with stage_duration.time(stage="wad_write"):
+        size, content_hash = write_wad(output_file, entries)
+    stage_bytes.observe(size, stage="wad_write")
+    return size, content_hash
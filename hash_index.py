@@ -0,0 +1,274 @@
+import bisect
+import heapq
+import logging
+import mmap
+import os
+import shutil
+import struct
+import tempfile
+import threading
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+from hashing import fnv1a, xxh64
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b"HIDX"
+FORMAT_VERSION = 1
+_HEADER = struct.Struct("<4sHHII")  # magic, format version, hash width, count, blob size
+
+# index name -> (hash width in bytes, CommunityDragon tables compiled into it)
+INDEX_TABLES: Dict[str, Tuple[int, Tuple[str, ...]]] = {
+    "bin": (4, ("hashes.binentries.txt", "hashes.binfields.txt", "hashes.binhashes.txt", "hashes.bintypes.txt")),
+    "game": (8, ("hashes.game.txt", "hashes.lcu.txt")),
+}
+
+
+def index_file_name(kind: str) -> str:
+    return f"hashes.{kind}.idx"
+
+
+def _table_files(hashes_dir: str, tables: Tuple[str, ...]) -> List[str]:
+    # large tables are published split as hashes.game.txt.0, hashes.game.txt.1, ...
+    names = sorted(os.listdir(hashes_dir))
+    return [
+        os.path.join(hashes_dir, name) for name in names
+        if any(name == table or name.startswith(f"{table}.") for table in tables)
+    ]
+
+
+_RUN_RECORD = struct.Struct("<QQI")  # hash, sequence, name length; the name follows
+
+
+def _write_run(entries: List[Tuple[int, int, bytes]], work_dir: str) -> str:
+    entries.sort()
+    fd, path = tempfile.mkstemp(dir=work_dir, suffix=".run")
+    with os.fdopen(fd, "wb") as f:
+        for h, seq, name in entries:
+            f.write(_RUN_RECORD.pack(h, seq, len(name)))
+            f.write(name)
+    return path
+
+
+def _read_run(path: str) -> Iterator[Tuple[int, int, bytes]]:
+    with open(path, "rb") as f:
+        while True:
+            record = f.read(_RUN_RECORD.size)
+            if not record:
+                return
+            h, seq, length = _RUN_RECORD.unpack(record)
+            yield h, seq, f.read(length)
+
+
+def _sorted_entries(sources: Iterable[str], work_dir: str, chunk_entries: int) -> Iterator[Tuple[int, bytes]]:
+    """(hash, name) of every table line in hash order, the last definition of a hash winning.
+
+    Lines are sorted in chunks of chunk_entries into run files and merged,
+    so memory stays bounded by one chunk whatever the table size.
+    """
+    runs = []
+    chunk: List[Tuple[int, int, bytes]] = []
+    seq = 0
+    for source in sources:
+        with open(source, "rb") as f:
+            for line in f:
+                hash_hex, _, name = line.rstrip(b"\r\n").partition(b" ")
+                if not name:
+                    continue
+                try:
+                    chunk.append((int(hash_hex, 16), seq, name))
+                except ValueError:
+                    continue
+                seq += 1
+                if len(chunk) >= chunk_entries:
+                    runs.append(_write_run(chunk, work_dir))
+                    chunk = []
+    if chunk:
+        runs.append(_write_run(chunk, work_dir))
+    pending = None
+    for h, _, name in heapq.merge(*(_read_run(run) for run in runs)):
+        if pending is not None and pending[0] != h:
+            yield pending
+        pending = (h, name)
+    if pending is not None:
+        yield pending
+
+
+def compile_hash_index(sources: Iterable[str], output: str, width: int, chunk_entries: int = 1_000_000) -> int:
+    """Compile "<hex hash> <name>" text tables into a sorted index file; returns the entry count.
+
+    The hash array, offsets and name blob are streamed into separate
+    scratch files and concatenated behind the header at the end.
+    """
+    output_dir = os.path.dirname(output) or "."
+    hash_format = struct.Struct("<I" if width == 4 else "<Q")
+    with tempfile.TemporaryDirectory(dir=output_dir, prefix=".hidx-") as work_dir:
+        count = 0
+        blob_size = 0
+        with open(os.path.join(work_dir, "hashes"), "wb") as hashes_file, \
+                open(os.path.join(work_dir, "offsets"), "wb") as offsets_file, \
+                open(os.path.join(work_dir, "blob"), "wb") as blob_file:
+            offsets_file.write(struct.pack("<I", 0))
+            for h, name in _sorted_entries(sources, work_dir, chunk_entries):
+                blob_size += len(name)
+                if blob_size > 0xFFFFFFFF:
+                    raise ValueError(f"Name blob of {output} exceeds 4 GiB")
+                hashes_file.write(hash_format.pack(h))
+                offsets_file.write(struct.pack("<I", blob_size))
+                blob_file.write(name)
+                count += 1
+
+        fd, tmp_path = tempfile.mkstemp(dir=output_dir, prefix=".", suffix=".idx")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(_HEADER.pack(MAGIC, FORMAT_VERSION, width, count, blob_size))
+                for part in ("hashes", "offsets", "blob"):
+                    with open(os.path.join(work_dir, part), "rb") as section:
+                        shutil.copyfileobj(section, f, 1024 * 1024)
+            os.chmod(tmp_path, 0o644)
+            os.replace(tmp_path, output)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+    return count
+
+
+def compile_hash_tables(hashes_dir: str) -> Dict[str, int]:
+    """Build every index of INDEX_TABLES inside hashes_dir from the tables found there."""
+    counts = {}
+    for kind, (width, tables) in INDEX_TABLES.items():
+        sources = _table_files(hashes_dir, tables)
+        if not sources:
+            continue
+        counts[kind] = compile_hash_index(sources, os.path.join(hashes_dir, index_file_name(kind)), width)
+        logger.info(f"Compiled {counts[kind]} {kind} hashes from {len(sources)} tables")
+    return counts
+
+
+class HashIndex:
+    """Read-only, mmap-backed view of one compiled index file.
+
+    Opening costs a header read; lookups binary-search the hash array in
+    place, so every process shares the page cache instead of parsing the
+    text tables into its own heap.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, "rb") as f:
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, self.width, self.count, blob_size = _HEADER.unpack_from(self.map, 0)
+        if magic != MAGIC or version != FORMAT_VERSION or self.width not in (4, 8):
+            self.map.close()
+            raise ValueError(f"{path} is not a version {FORMAT_VERSION} hash index")
+        hashes_end = _HEADER.size + self.count * self.width
+        offsets_end = hashes_end + (self.count + 1) * 4
+        if len(self.map) != offsets_end + blob_size:
+            self.map.close()
+            raise ValueError(f"{path} is truncated")
+        view = memoryview(self.map)
+        self.hashes = view[_HEADER.size:hashes_end].cast("I" if self.width == 4 else "Q")
+        self.offsets = view[hashes_end:offsets_end].cast("I")
+        self.blob_start = offsets_end
+
+    def __len__(self) -> int:
+        return self.count
+
+    def __contains__(self, h: int) -> bool:
+        return self._find(h) is not None
+
+    def _find(self, h: int, lo: int = 0) -> Optional[int]:
+        i = bisect.bisect_left(self.hashes, h, lo)
+        if i < self.count and self.hashes[i] == h:
+            return i
+        return None
+
+    def _name_at(self, i: int) -> str:
+        start = self.blob_start + self.offsets[i]
+        end = self.blob_start + self.offsets[i + 1]
+        return self.map[start:end].decode("utf-8", "replace")
+
+    def name(self, h: int) -> Optional[str]:
+        i = self._find(h)
+        return None if i is None else self._name_at(i)
+
+    def names(self, hashes: Iterable[int]) -> List[Optional[str]]:
+        """Batch lookup; queries are resolved in sorted order so each search starts where the last ended."""
+        hashes = list(hashes)
+        result: List[Optional[str]] = [None] * len(hashes)
+        lo = 0
+        for position in sorted(range(len(hashes)), key=hashes.__getitem__):
+            i = bisect.bisect_left(self.hashes, hashes[position], lo)
+            lo = i
+            if i < self.count and self.hashes[i] == hashes[position]:
+                result[position] = self._name_at(i)
+        return result
+
+    def hash(self, name: str) -> int:
+        """Hash a name the way the index's tables are keyed (FNV-1a for BIN, XXH64 for paths)."""
+        if self.width == 4:
+            return fnv1a(name)
+        return xxh64(name.lower().encode("utf-8"))
+
+    def close(self) -> None:
+        self.hashes.release()
+        self.offsets.release()
+        self.map.close()
+
+
+class HashIndexes:
+    """Lazily opened indexes of the live hashes directory.
+
+    The directory is swapped as a whole on refresh, so an index is reopened
+    whenever the generation behind the hashes symlink changes.
+    """
+
+    def __init__(self, hashes_dir: str):
+        self.hashes_dir = hashes_dir
+        self.lock = threading.Lock()
+        self.opened: Dict[str, Tuple[str, HashIndex]] = {}
+
+    def get(self, kind: str) -> Optional[HashIndex]:
+        path = os.path.realpath(os.path.join(self.hashes_dir, index_file_name(kind)))
+        with self.lock:
+            opened = self.opened.get(kind)
+            if opened is not None and opened[0] == path:
+                return opened[1]
+            if not os.path.exists(path):
+                return None
+            # the replaced index stays mapped until its last reader drops it
+            index = HashIndex(path)
+            self.opened[kind] = (path, index)
+            return index
+
+    def name(self, h: int, kind: str = "bin") -> Optional[str]:
+        index = self.get(kind)
+        return index.name(h) if index is not None else None
+
+    def names(self, hashes: Iterable[int], kind: str = "bin") -> List[Optional[str]]:
+        index = self.get(kind)
+        hashes = list(hashes)
+        return index.names(hashes) if index is not None else [None] * len(hashes)
+
+    def describe(self, h: int, kind: str = "bin") -> str:
+        """Name of a hash for logs, or its hex form when the index does not know it."""
+        name = self.name(h, kind)
+        if name is not None:
+            return name
+        return f"{h:#010x}" if INDEX_TABLES[kind][0] == 4 else f"{h:#018x}"
+
+    def hash(self, name: str, kind: str = "bin") -> int:
+        return fnv1a(name) if INDEX_TABLES[kind][0] == 4 else xxh64(name.lower().encode("utf-8"))
+
+
+hash_indexes = HashIndexes(os.path.join(os.path.dirname(os.path.abspath(__file__)), "hashes"))
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Compile CommunityDragon hash tables into mmap indexes")
+    parser.add_argument("hashes_dir", nargs="?", default=hash_indexes.hashes_dir)
+    args = parser.parse_args()
+    print(compile_hash_tables(args.hashes_dir))
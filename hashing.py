@@ -0,0 +1,96 @@
+import struct
+
+try:
+    import xxhash
+except ImportError:
+    xxhash = None
+
+
+def fnv1a(name: str) -> int:
+    """Lowercase FNV-1a 32 bit hash used by BIN entry, class and field names."""
+    h = 0x811C9DC5
+    for byte in name.lower().encode("utf-8"):
+        h ^= byte
+        h = (h * 0x01000193) & 0xFFFFFFFF
+    return h
+
+
+def bin_key_to_hash(key) -> int:
+    """Convert a ritobin JSON key ("0x1234abcd" or an unhashed name) to its u32 hash."""
+    if isinstance(key, int):
+        return key
+    if key.startswith("0x"):
+        return int(key, 16)
+    return fnv1a(key)
+
+
+_P1 = 11400714785074694791
+_P2 = 14029467366897019727
+_P3 = 1609587929392839161
+_P4 = 9650029242287828579
+_P5 = 2870177450012600261
+_MASK = 0xFFFFFFFFFFFFFFFF
+
+
+def _rotl(value: int, bits: int) -> int:
+    return ((value << bits) | (value >> (64 - bits))) & _MASK
+
+
+def _round(acc: int, lane: int) -> int:
+    acc = (acc + lane * _P2) & _MASK
+    return (_rotl(acc, 31) * _P1) & _MASK
+
+
+def _xxh64_python(data: bytes, seed: int = 0) -> int:
+    length = len(data)
+    pos = 0
+    if length >= 32:
+        v1 = (seed + _P1 + _P2) & _MASK
+        v2 = (seed + _P2) & _MASK
+        v3 = seed
+        v4 = (seed - _P1) & _MASK
+        while pos <= length - 32:
+            a, b, c, d = struct.unpack_from("<4Q", data, pos)
+            v1, v2, v3, v4 = _round(v1, a), _round(v2, b), _round(v3, c), _round(v4, d)
+            pos += 32
+        h = (_rotl(v1, 1) + _rotl(v2, 7) + _rotl(v3, 12) + _rotl(v4, 18)) & _MASK
+        for v in (v1, v2, v3, v4):
+            h ^= _round(0, v)
+            h = (h * _P1 + _P4) & _MASK
+    else:
+        h = (seed + _P5) & _MASK
+    h = (h + length) & _MASK
+    while pos <= length - 8:
+        h ^= _round(0, struct.unpack_from("<Q", data, pos)[0])
+        h = (_rotl(h, 27) * _P1 + _P4) & _MASK
+        pos += 8
+    if pos <= length - 4:
+        h ^= (struct.unpack_from("<I", data, pos)[0] * _P1) & _MASK
+        h = (_rotl(h, 23) * _P2 + _P3) & _MASK
+        pos += 4
+    while pos < length:
+        h ^= (data[pos] * _P5) & _MASK
+        h = (_rotl(h, 11) * _P1) & _MASK
+        pos += 1
+    h ^= h >> 33
+    h = (h * _P2) & _MASK
+    h ^= h >> 29
+    h = (h * _P3) & _MASK
+    h ^= h >> 32
+    return h
+
+
+def xxh64(data: bytes, seed: int = 0) -> int:
+    """XXH64 digest, using the xxhash package when it is installed."""
+    if xxhash is not None:
+        return xxhash.xxh64_intdigest(data, seed)
+    return _xxh64_python(data, seed)
+
+
+def wad_path_hash(path: str) -> int:
+    """Hash a WAD virtual path; "<16 hex digits>.ext" names are already hashed."""
+    path = path.replace("\\", "/").lower()
+    stem = path.rsplit("/", 1)[-1].split(".", 1)[0]
+    if len(stem) == 16 and all(c in "0123456789abcdef" for c in stem):
+        return int(stem, 16)
+    return xxh64(path.encode("utf-8"))
@@ -1,3 +1,4 @@
+import asyncio
 import os
 import logging
 import subprocess
@@ -9,26 +10,88 @@ from livekit.api import ListParticipantsRequest
 
 from sqlmodel import Session
 from UpdateManager import UpdateManager, HashUpdateManager
-from fastapi.responses import FileResponse
-from extractor import process_character_directory, get_script_dir
-from models.models import create_db_and_tables, seed_database, getApiVersion, engine
-from skin_file_fetcher import download_skin
+from skin_response import skin_file_response
+from skin_bundle import BundleRequest, stream_bundle, unique_pairs
+from extractor import get_script_dir
+from build_coordinator import build_coordinator, cdn_file_path, rebuild_scheduler
+from build_manifest import build_manifest
+from catalog_index import catalog_index
+from catalog_reads import catalog_reads
+from storage_manager import storage_manager
+from models.models import create_db_and_tables, seed_database, getApiVersion, engine, async_engine
+from version_resolver import version_resolver
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 from apscheduler.triggers.interval import IntervalTrigger
 from apscheduler.jobstores.sqlalchemy import SQLAlchemyJobStore
-from fastapi import FastAPI
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from metrics import cache_result, registry
 from contextlib import asynccontextmanager
 
 logger = logging.getLogger(__name__)
 
 
+class StartupState:
+    """Progress of the startup work that runs after the app starts serving."""
+
+    def __init__(self):
+        self.steps = {"version": "pending", "catalog": "pending"}
+        self.errors = {}
+        self.finished = asyncio.Event()
+
+    def mark(self, step: str, error: Exception = None) -> None:
+        self.steps[step] = "failed" if error else "ready"
+        if error:
+            self.errors[step] = str(error)
+        else:
+            self.errors.pop(step, None)
+
+    @property
+    def ready(self) -> bool:
+        return all(status == "ready" for status in self.steps.values())
+
+    def status(self) -> dict:
+        return {"ready": self.ready, "steps": dict(self.steps), "errors": dict(self.errors),
+                "version": version_resolver.version}
+
+
+startup_state = StartupState()
+
+
+async def background_startup():
+    """Resolve the game version and sync the catalog without holding up the first requests."""
+    try:
+        version = await asyncio.to_thread(version_resolver.get)
+        startup_state.mark("version")
+    except Exception as e:
+        logger.error(f"Startup version resolution failed: {e}")
+        startup_state.mark("version", e)
+    else:
+        # pending jobs are only resumed once it is known which version they must match
+        try:
+            await asyncio.to_thread(rebuild_scheduler.resume, version[:-2])
+        except Exception as e:
+            logger.error(f"Resuming pending rebuilds failed: {e}")
+    try:
+        logger.info("Starting database seeding")
+        if await asyncio.to_thread(seed_database):
+            catalog_index.invalidate()
+            catalog_reads.invalidate()
+        startup_state.mark("catalog")
+    except Exception as e:
+        logger.error(f"Startup catalog sync failed: {e}")
+        startup_state.mark("catalog", e)
+    startup_state.finished.set()
+
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # Startup
     logger.info("Starting database initialization")
     create_db_and_tables()
-    logger.info("Starting database seeding")
-    seed_database()
+    build_manifest.all()
+    # archives already in cdn/ are served right away, network work happens in the background
+    startup_task = asyncio.create_task(background_startup())
     jobstores = {
         'default': SQLAlchemyJobStore(
             url=os.getenv("SCHEDULER_DATABASE_URL")
@@ -49,6 +112,13 @@ async def lifespan(app: FastAPI):
         max_instances=1,
         # next_run_time=datetime.now()
     )
+    scheduler.add_job(
+        background_storage_maintenance,
+        trigger=IntervalTrigger(minutes=int(os.getenv("STORAGE_INTERVAL_MINUTES", 10))),
+        id='storage_maintenance',
+        replace_existing=True,
+        max_instances=1,
+    )
     # Add the hourly job
     scheduler.add_job(
         background_update_process,
@@ -67,7 +137,10 @@ async def lifespan(app: FastAPI):
     yield
 
     # Shutdown
+    startup_task.cancel()
     scheduler.shutdown(wait=False)
+    build_coordinator.shutdown()
+    await async_engine.dispose()
     logger.info("Scheduler stopped")
 
 
@@ -76,19 +149,32 @@ async def background_hashes_update():
         logger.info("Starting scheduled Hashes update process...")
 
         hash_updater = HashUpdateManager()
-        hash_updater.update_hashes()
+        await asyncio.to_thread(hash_updater.update_hashes)
     except Exception as e:
         logger.error(f"Error in Hashes update process: {e}")
 
 
+async def background_storage_maintenance():
+    try:
+        report = await asyncio.to_thread(storage_manager.run_once)
+        await asyncio.to_thread(rebuild_scheduler.prune)
+        if report.get("evicted") or report.get("gc_trees"):
+            logger.info(f"Storage maintenance reclaimed {report['evicted_bytes'] + report['gc_bytes']} bytes: {report}")
+    except Exception as e:
+        logger.error(f"Error in storage maintenance: {e}")
+
+
 async def background_update_process():
     try:
+        await startup_state.finished.wait()
         logger.info("Starting scheduled update process...")
 
         with Session(engine) as db:
             try:
-                update_manager = UpdateManager(db)
-                update_manager.pull_changes_from_riot_api()
+                update_manager = await asyncio.to_thread(UpdateManager, db)
+                await asyncio.to_thread(update_manager.pull_changes_from_riot_api)
+                startup_state.mark("version")
+                startup_state.mark("catalog")
                 await update_manager.start_updating_cdn()
             except Exception as db_error:
                 logger.error(f"Database operation failed: {db_error}")
@@ -109,31 +195,82 @@ async def root():
     return {"service is running in healthy state ........"}
 
 
+@app.get("/ready")
+async def ready():
+    status = startup_state.status()
+    return JSONResponse(status, status_code=200 if status["ready"] else 503)
+
+
+@app.get("/rebuilds/status")
+async def rebuilds_status():
+    return rebuild_scheduler.status()
+
+
+@app.get("/storage/status")
+async def storage_status():
+    return storage_manager.status()
+
+
+@app.get("/metrics")
+async def metrics():
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4")
+
+
+async def resolve_archive(champId: str, skinId: str):
+    """Manifest record and cdn/ path of a skin archive, building it first if needed."""
+    file_path = cdn_file_path(get_script_dir(), champId, skinId)
+    record = build_manifest.get(champId, skinId)
+    cache_result("build_manifest", record is not None)
+    if record is not None and not os.path.exists(file_path):
+        # the archive was evicted or never written: forget the record and build it again
+        await asyncio.to_thread(build_manifest.remove, champId, skinId)
+        record = None
+    if record is None:
+        if os.path.exists(file_path):
+            try:
+                record = await asyncio.to_thread(build_manifest.adopt, champId, skinId, file_path)
+            except FileNotFoundError:
+                pass  # deleted since the check, build it below
+        if record is None:
+            if startup_state.steps["catalog"] == "ready" and await catalog_reads.champion(champId) is None:
+                raise HTTPException(status_code=404, detail="Unknown champion")
+            try:
+                api_version = await asyncio.to_thread(getApiVersion)
+            except RuntimeError as e:
+                logger.warning(f"Cannot build {champId}/{skinId} yet: {e}")
+                api_version = None
+            if not api_version:
+                raise HTTPException(status_code=503, detail="Game version not resolved yet")
+            api_version = api_version[:-2]
+            try:
+                file_path = await build_coordinator.build(api_version, champId, skinId)
+            except Exception as e:
+                logger.error(f"Build failed for {champId}/{skinId}: {e}")
+                raise HTTPException(status_code=502, detail="Skin build failed")
+            record = build_manifest.get(champId, skinId)
+    storage_manager.touch(champId, skinId)
+    return record, file_path
+
+
+def _is_cached(champId: str, skinId: str) -> bool:
+    return build_manifest.get(champId, skinId) is not None
+
+
 @app.get("/skin/{champId}/{skinId}")
-async def get_skin(champId: str, skinId: str):
-    file_path = ""
-    script_dir = get_script_dir()
-    api_version = getApiVersion()[:-2]
-    if os.path.exists(os.path.join(script_dir, "cdn", champId, f"{skinId}.wad.client")):
-        file_path = os.path.join(script_dir, "cdn", champId, f"{skinId}.wad.client")
-        return FileResponse(
-            path=file_path,
-            filename=f"{skinId}.wad.client",  # name user sees when saving
-            media_type='application/octet-stream'  # generic binary type
-        )
-    else:
-        download_skin(champId, skinId)
-        process_character_directory(
-            script_dir, champId, skinId, api_version
-        )
-        file_path = os.path.join(script_dir, "cdn", champId, f"{skinId}.wad.client")
-        return FileResponse(
-            path=file_path,
-            filename=f"{skinId}.wad.client",  # name user sees when saving
-            media_type='application/octet-stream'  # generic binary type
-        )
+async def get_skin(champId: str, skinId: str, request: Request):
+    record, file_path = await resolve_archive(champId, skinId)
+    return await skin_file_response(request, record, file_path, f"{skinId}.wad.client")
 
 
+@app.post("/skins/bundle")
+async def get_skin_bundle(bundle: BundleRequest):
+    pairs = unique_pairs(bundle)
+    return StreamingResponse(
+        stream_bundle(pairs, _is_cached, resolve_archive),
+        media_type="application/zip",
+        headers={"Content-Disposition": 'attachment; filename="skins.zip"'},
+    )
+
 
 @app.get("/party/accessToken/{room_id}/{identity}")
 async def generate_party_token(room_id: str, identity: str):
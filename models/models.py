@@ -1,11 +1,18 @@
 import json
+import os
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-from typing import Annotated,Dict,Optional
+from typing import Annotated,Dict,List,Optional
 import logging
 logger = logging.getLogger(__name__)
 import requests
 from fastapi import Depends, FastAPI, HTTPException, Query
+from sqlalchemy import event
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.ext.asyncio import create_async_engine
 from sqlmodel import Field, Session, SQLModel, create_engine, select,Relationship
+from version_resolver import version_resolver, DDRAGON_BASE_URL
+from metrics import upstream_responses
 
 class Champion(SQLModel, table=True):
     id: Optional[str] = Field(default=None, primary_key=True)
@@ -23,11 +30,76 @@ class Skin(SQLModel, table=True):
     __table_args__ = (
 
     )
+
+
+class CatalogState(SQLModel, table=True):
+    key: str = Field(primary_key=True)
+    value: str
+
+
+class BuildRecord(SQLModel, table=True):
+    champion_id: str = Field(primary_key=True)
+    skin_id: str = Field(primary_key=True)
+    version: str = Field(index=True)
+    size: int = Field(default=0)
+    content_hash: Optional[str] = Field(default=None)
+    source_hashes: str = Field(default="{}")  # JSON object of source file -> sha256
+    build_duration: float = Field(default=0.0)
+    built_at: datetime = Field(default_factory=datetime.utcnow)
+
+
+class RebuildJob(SQLModel, table=True):
+    version: str = Field(primary_key=True)
+    champion_id: str = Field(primary_key=True)
+    skin_id: str = Field(primary_key=True)
+    priority: int = Field(default=10)
+    status: str = Field(default="pending", index=True)  # pending, done, failed or superseded
+    error: Optional[str] = Field(default=None)
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+    finished_at: Optional[datetime] = Field(default=None)
+
+
+class SkinAvailability(SQLModel, table=True):
+    champion_id: str = Field(primary_key=True)
+    skin_id: str = Field(primary_key=True)
+    version: str = Field(primary_key=True)
+    available: bool = Field(default=False)
+    status_code: int = Field(default=0)
+    checked_at: datetime = Field(default_factory=datetime.utcnow)
+
+
+class ArchiveAccess(SQLModel, table=True):
+    champion_id: str = Field(primary_key=True)
+    skin_id: str = Field(primary_key=True)
+    last_served: datetime = Field(default_factory=datetime.utcnow)
+
+
 sqlite_file_name = "mistrShifo.db"
 sqlite_url = f"sqlite:///{sqlite_file_name}"
 
-connect_args = {"check_same_thread": False}
-engine = create_engine(sqlite_url, connect_args=connect_args)
+async_sqlite_url = f"sqlite+aiosqlite:///{sqlite_file_name}"
+DB_BUSY_TIMEOUT_MS = int(os.getenv("DB_BUSY_TIMEOUT_MS", 5000))
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", 5))
+
+connect_args = {"check_same_thread": False, "timeout": DB_BUSY_TIMEOUT_MS / 1000}
+engine = create_engine(sqlite_url, connect_args=connect_args,
+                       pool_size=DB_POOL_SIZE, max_overflow=2 * DB_POOL_SIZE)
+# request handlers read through aiosqlite so a query never blocks the event loop
+async_engine = create_async_engine(async_sqlite_url, connect_args=connect_args,
+                                   pool_size=DB_POOL_SIZE, max_overflow=2 * DB_POOL_SIZE)
+
+
+def _configure_sqlite(dbapi_connection, connection_record):
+    # WAL lets readers run while the catalog sync or a build holds the write lock
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute(f"PRAGMA busy_timeout={DB_BUSY_TIMEOUT_MS}")
+    cursor.close()
+
+
+event.listen(engine, "connect", _configure_sqlite)
+event.listen(async_engine.sync_engine, "connect", _configure_sqlite)
 
 def create_db_and_tables():
     SQLModel.metadata.create_all(engine)
@@ -39,51 +111,90 @@ def get_session():
         yield session
 SessionDep = Annotated[Session, Depends(get_session)]
 
+
 def getApiVersion() -> str:
-    response = requests.get("https://ddragon.leagueoflegends.com/api/versions.json")
-    apiVersion = json.loads(response.text)[0]
-    return apiVersion
-def get_champion_data() -> Dict:
+    return version_resolver.get()
+def _fetch_champion_details(http: requests.Session, apiVersion: str, champ_id: str) -> Dict:
+    url = f"{DDRAGON_BASE_URL}/cdn/{apiVersion}/data/en_US/champion/{champ_id}.json"
+    ch_detail_response = http.get(url, timeout=30)
+    upstream_responses.inc(upstream="ddragon", status=ch_detail_response.status_code)
+    ch_detail_response.raise_for_status()
+    return json.loads(ch_detail_response.text)["data"][champ_id]
+
+
+def get_champion_data(apiVersion: Optional[str] = None) -> Dict:
     champions_dict = {}
-    apiVersion = getApiVersion()
-    url = f"https://ddragon.leagueoflegends.com/cdn/{apiVersion}/data/en_US/champion.json"
-    championsData_Response = requests.get(url)
-    championData = json.loads(championsData_Response.text)
-    for champ in championData["data"].items():
-        url = f"https://ddragon.leagueoflegends.com/cdn/{apiVersion}/data/en_US/champion/{champ[1]['id']}.json"
-        ch_detail_response = requests.get(url)
-        champ_details = json.loads(ch_detail_response.text)
-        champions_dict[champ_details["data"][champ[0]]["key"]] = champ_details["data"][champ[0]]
+    apiVersion = apiVersion or getApiVersion()
+    workers = int(os.getenv("CATALOG_SYNC_WORKERS", 16))
+    with requests.Session() as http:
+        http.mount("https://", requests.adapters.HTTPAdapter(pool_maxsize=workers))
+        http.mount("http://", requests.adapters.HTTPAdapter(pool_maxsize=workers))
+        url = f"{DDRAGON_BASE_URL}/cdn/{apiVersion}/data/en_US/champion.json"
+        championsData_Response = http.get(url, timeout=30)
+        championsData_Response.raise_for_status()
+        championData = json.loads(championsData_Response.text)
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            for details in executor.map(
+                lambda champ_id: _fetch_champion_details(http, apiVersion, champ_id), championData["data"]
+            ):
+                champions_dict[details["key"]] = details
     return champions_dict
 
 
-def seed_database():
+def _upsert(db: Session, table, rows: List[Dict], index_elements: List[str], update_columns: List[str]) -> None:
+    # keep each statement under SQLite's bound-parameter limit
+    for start in range(0, len(rows), 200):
+        stmt = sqlite_insert(table).values(rows[start:start + 200])
+        db.exec(stmt.on_conflict_do_update(
+            index_elements=index_elements,
+            set_={column: stmt.excluded[column] for column in update_columns},
+        ))
+
+
+def seed_database(force: bool = False) -> bool:
+    """Sync the champion catalog with ddragon, returning True when any row changed.
+
+    The run is skipped when the catalog was already synced for the current
+    game version; otherwise only new or changed rows are upserted, all in
+    one transaction.
+    """
+    apiVersion = getApiVersion()
     with Session(engine) as db:
-        champions_data = get_champion_data()
-
-        for champ_key in champions_data:
-            details = champions_data[champ_key]
-
-            # Create or update champion
-            champ = Champion(
-                id=champ_key,
-                champ_code=details["id"],
-                champ_name=details["name"],
-                date_created=datetime.utcnow(),
-                date_updated=datetime.utcnow()
-            )
-            db.merge(champ)
-
-            # Process skins
+        synced = db.get(CatalogState, "catalog_version")
+        if not force and synced is not None and synced.value == apiVersion:
+            logger.info(f"Catalog already synced for {apiVersion}, skipping")
+            return False
+
+        champions_data = get_champion_data(apiVersion)
+        stored_champions = {
+            champ.id: (champ.champ_code, champ.champ_name) for champ in db.exec(select(Champion)).all()
+        }
+        stored_skins = {
+            (skin.champion_id, skin.id): skin.skin_name for skin in db.exec(select(Skin)).all()
+        }
+
+        now = datetime.utcnow()
+        champion_rows = []
+        skin_rows = []
+        for champ_key, details in champions_data.items():
+            if stored_champions.get(champ_key) != (details["id"], details["name"]):
+                champion_rows.append({
+                    "id": champ_key,
+                    "champ_code": details["id"],
+                    "champ_name": details["name"],
+                    "date_created": now,
+                    "date_updated": now,
+                })
             for skin in details["skins"]:
                 skin_id = f"{skin['num']}"
-                skin_obj = Skin(
-                    id=skin_id,
-                    champion_id=champ_key,
-                    skin_name=skin["name"],
-                    champion=champ
-                )
-                db.merge(skin_obj)
-        db.commit()
-        logger.info("Database seeded successfully!")
+                if stored_skins.get((champ_key, skin_id), object()) != skin["name"]:
+                    skin_rows.append({"id": skin_id, "champion_id": champ_key, "skin_name": skin["name"]})
 
+        _upsert(db, Champion.__table__, champion_rows, ["id"], ["champ_code", "champ_name", "date_updated"])
+        _upsert(db, Skin.__table__, skin_rows, ["id", "champion_id"], ["skin_name"])
+        db.merge(CatalogState(key="catalog_version", value=apiVersion))
+        db.commit()
+        logger.info(
+            f"Database seeded successfully! {len(champion_rows)} champions and {len(skin_rows)} skins changed"
+        )
+        return bool(champion_rows or skin_rows)
@@ -0,0 +1,296 @@
+import argparse
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import wait
+from typing import Dict, List, Optional, Set, Tuple
+
+from sqlmodel import Session, select
+
+from build_coordinator import build_champion, build_skin, cdn_file_path
+from build_manifest import build_manifest
+from extractor import get_script_dir
+from models.models import Champion, Skin, create_db_and_tables, engine, seed_database
+from rebuild_scheduler import PRIORITY_BACKGROUND, RebuildScheduler
+from version_resolver import version_resolver
+
+logger = logging.getLogger(__name__)
+
+SkinIds = Tuple[str, str]
+_UNITS = {"K": 1024, "M": 1024 ** 2, "G": 1024 ** 3, "T": 1024 ** 4}
+
+
+class DiskBudgetExceeded(RuntimeError):
+    pass
+
+
+def parse_size(value: str) -> int:
+    """Parse "512M", "20G" or a plain byte count."""
+    value = value.strip().upper().removesuffix("B")
+    if value and value[-1] in _UNITS:
+        return int(float(value[:-1]) * _UNITS[value[-1]])
+    return int(value)
+
+
+def directory_size(path: str) -> int:
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.lstat(os.path.join(root, name)).st_size
+            except FileNotFoundError:
+                pass
+    return total
+
+
+class DiskBudget:
+    """Tracks the bytes used by cdn/ and the version's base files against a limit.
+
+    Usage is re-measured at most every refresh_seconds so many workers can
+    check the budget before every build without walking the tree each time.
+    """
+
+    def __init__(self, paths: List[str], limit: Optional[int], refresh_seconds: float = 5.0):
+        self.paths = paths
+        self.limit = limit
+        self.refresh_seconds = refresh_seconds
+        self.lock = threading.Lock()
+        self.measured_at = 0.0
+        self.usage = 0
+
+    def used(self) -> int:
+        with self.lock:
+            if time.monotonic() - self.measured_at > self.refresh_seconds:
+                self.usage = sum(directory_size(path) for path in self.paths)
+                self.measured_at = time.monotonic()
+            return self.usage
+
+    def check(self) -> None:
+        if self.limit is not None and self.used() >= self.limit:
+            raise DiskBudgetExceeded(f"disk budget of {self.limit} bytes reached")
+
+
+class Checkpoint:
+    """JSON record of finished and failed skins of one prebuild, rewritten atomically."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.lock = threading.Lock()
+        try:
+            with open(path, "r") as f:
+                state = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            state = {}
+        self.done: Set[SkinIds] = {tuple(ids) for ids in state.get("done", [])}
+        self.failed: Dict[SkinIds, str] = {
+            (champ_id, skin_id): error for champ_id, skin_id, error in state.get("failed", [])
+        }
+
+    def mark(self, ids: SkinIds, error: Optional[str] = None) -> None:
+        with self.lock:
+            if error is None:
+                self.done.add(ids)
+                self.failed.pop(ids, None)
+            else:
+                self.failed[ids] = error
+            self._save()
+
+    def _save(self) -> None:
+        state = {
+            "done": sorted(self.done),
+            "failed": [[champ_id, skin_id, error] for (champ_id, skin_id), error in sorted(self.failed.items())],
+        }
+        with open(f"{self.path}.tmp", "w") as f:
+            json.dump(state, f)
+        os.replace(f"{self.path}.tmp", self.path)
+
+
+def select_targets(version: str, champions: List[str], skins: List[str], rebuild: bool) -> List[SkinIds]:
+    """Catalog skins to build, filtered by champion id/code/name and skin id."""
+    wanted_champions = {value.lower() for value in champions}
+    with Session(engine) as db:
+        rows = db.exec(select(Skin, Champion).where(Skin.champion_id == Champion.id)).all()
+    targets = []
+    for skin, champ in rows:
+        if skin.id == "0":
+            continue
+        if wanted_champions and not wanted_champions & {
+            champ.id.lower(), (champ.champ_code or "").lower(), (champ.champ_name or "").lower()
+        }:
+            continue
+        if skins and skin.id not in skins:
+            continue
+        record = build_manifest.get(champ.id, skin.id)
+        if not rebuild and record is not None and record.version == version:
+            continue
+        targets.append((champ.id, skin.id))
+    return sorted(targets, key=lambda ids: (ids[0], int(ids[1]) if ids[1].isdigit() else ids[1]))
+
+
+def estimate(targets: List[SkinIds], workers: int) -> Dict[str, float]:
+    """Estimate bytes and wall time of a prebuild from the manifest's past builds."""
+    records = [record for record in build_manifest.all() if record.size]
+    by_champion: Dict[str, List[int]] = {}
+    for record in records:
+        by_champion.setdefault(record.champion_id, []).append(record.size)
+    average_size = sum(record.size for record in records) / len(records) if records else 0
+    timed = [record.build_duration for record in records if record.build_duration]
+    average_duration = sum(timed) / len(timed) if timed else 0
+    total_bytes = sum(
+        sum(by_champion[champ_id]) / len(by_champion[champ_id]) if champ_id in by_champion else average_size
+        for champ_id, _ in targets
+    )
+    return {
+        "skins": len(targets),
+        "estimated_bytes": int(total_bytes),
+        "estimated_seconds": round(average_duration * len(targets) / max(workers, 1), 1),
+    }
+
+
+def prebuild(version: str, targets: List[SkinIds], workers: int, checkpoint: Checkpoint,
+             budget: DiskBudget) -> Dict[str, float]:
+    """Build every target on a dedicated scheduler, returning throughput stats."""
+    script_dir = get_script_dir()
+    stop = threading.Event()
+
+    def runner(api_version: str, champ_id: str, skin_id: str) -> str:
+        if stop.is_set():
+            raise DiskBudgetExceeded("prebuild stopped")
+        try:
+            budget.check()
+        except DiskBudgetExceeded:
+            stop.set()
+            raise
+        return build_skin(api_version, champ_id, skin_id)
+
+    scheduler = RebuildScheduler(runner, max_workers=workers)
+    started = time.monotonic()
+    futures = {scheduler.submit(version, champ_id, skin_id, PRIORITY_BACKGROUND): (champ_id, skin_id)
+               for champ_id, skin_id in targets}
+    built = failed = 0
+    written = 0
+    try:
+        for future in futures:
+            ids = futures[future]
+            wait([future])
+            error = future.exception()
+            if error is None:
+                built += 1
+                path = cdn_file_path(script_dir, *ids)
+                written += os.path.getsize(path) if os.path.exists(path) else 0
+                checkpoint.mark(ids)
+            elif not isinstance(error, DiskBudgetExceeded):
+                failed += 1
+                checkpoint.mark(ids, str(error))
+            done = built + failed
+            if done and done % 25 == 0:
+                logger.info(f"Prebuild progress: {done}/{len(targets)} ({scheduler.status()})")
+    finally:
+        scheduler.shutdown()
+    elapsed = time.monotonic() - started
+    return {
+        "built": built,
+        "failed": failed,
+        "skipped_by_budget": len(targets) - built - failed,
+        "bytes_written": written,
+        "elapsed_seconds": round(elapsed, 1),
+        "skins_per_second": round(built / elapsed, 3) if elapsed else 0.0,
+        "megabytes_per_second": round(written / elapsed / 1024 ** 2, 3) if elapsed else 0.0,
+    }
+
+
+def prebuild_by_champion(version: str, targets: List[SkinIds], workers: int, checkpoint: Checkpoint,
+                         budget: DiskBudget) -> Dict[str, float]:
+    """Build the targets one champion at a time, sharing downloads and base decoding per champion."""
+    script_dir = get_script_dir()
+    by_champion: Dict[str, List[str]] = {}
+    for champ_id, skin_id in targets:
+        by_champion.setdefault(champ_id, []).append(skin_id)
+    started = time.monotonic()
+    built = failed = 0
+    written = 0
+    for champ_id, skin_ids in by_champion.items():
+        try:
+            budget.check()
+        except DiskBudgetExceeded as e:
+            logger.warning(f"Prebuild stopped: {e}")
+            break
+        for skin_id, result in sorted(build_champion(version, champ_id, skin_ids, workers).items()):
+            if result["ok"]:
+                built += 1
+                path = cdn_file_path(script_dir, champ_id, skin_id)
+                written += os.path.getsize(path) if os.path.exists(path) else 0
+                checkpoint.mark((champ_id, skin_id))
+            else:
+                failed += 1
+                checkpoint.mark((champ_id, skin_id), result["error"])
+        logger.info(f"Prebuild progress: {built + failed}/{len(targets)} after {champ_id}")
+    elapsed = time.monotonic() - started
+    return {
+        "built": built,
+        "failed": failed,
+        "skipped_by_budget": len(targets) - built - failed,
+        "bytes_written": written,
+        "elapsed_seconds": round(elapsed, 1),
+        "skins_per_second": round(built / elapsed, 3) if elapsed else 0.0,
+        "megabytes_per_second": round(written / elapsed / 1024 ** 2, 3) if elapsed else 0.0,
+    }
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Prebuild skin archives into cdn/ ahead of traffic")
+    parser.add_argument("--version", help="game version to build for, defaults to the current one")
+    parser.add_argument("--champion", action="append", default=[],
+                        help="champion id, code or name to build (repeatable, default all)")
+    parser.add_argument("--skin", action="append", default=[], help="skin id to build (repeatable, default all)")
+    parser.add_argument("--workers", type=int, default=int(os.getenv("BUILD_WORKERS", min(4, os.cpu_count() or 1))))
+    parser.add_argument("--max-disk", type=parse_size,
+                        help="stop once cdn/ and the version's base files use this much (e.g. 20G)")
+    parser.add_argument("--checkpoint", help="checkpoint file, defaults to prebuild-<version>.json")
+    parser.add_argument("--retry-failed", action="store_true", help="retry skins the checkpoint records as failed")
+    parser.add_argument("--rebuild", action="store_true", help="rebuild skins already built for the version")
+    parser.add_argument("--by-champion", action="store_true",
+                        help="build each champion's skins in one pass instead of one build per skin")
+    parser.add_argument("--dry-run", action="store_true", help="only print what would be built and an estimate")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+    create_db_and_tables()
+    seed_database()
+    version = args.version or version_resolver.get()
+    if version.count(".") > 1:
+        version = version.rsplit(".", 1)[0]  # builds are keyed by major.minor
+
+    script_dir = get_script_dir()
+    checkpoint = Checkpoint(args.checkpoint or os.path.join(script_dir, f"prebuild-{version}.json"))
+    targets = [
+        ids for ids in select_targets(version, args.champion, args.skin, args.rebuild)
+        if args.rebuild or (ids not in checkpoint.done and (args.retry_failed or ids not in checkpoint.failed))
+    ]
+    budget = DiskBudget(
+        [os.path.join(script_dir, "cdn"), os.path.join(script_dir, "base_skinsfiles", version)], args.max_disk
+    )
+
+    if args.dry_run:
+        report = estimate(targets, args.workers)
+        report["disk_used"] = budget.used()
+        report["disk_budget"] = args.max_disk
+        print(json.dumps(report, indent=2))
+        return 0
+    if not targets:
+        print(f"Nothing to build for {version}")
+        return 0
+
+    logger.info(f"Prebuilding {len(targets)} skins for {version} with {args.workers} workers")
+    run = prebuild_by_champion if args.by_champion else prebuild
+    stats = run(version, targets, args.workers, checkpoint, budget)
+    print(json.dumps(stats, indent=2))
+    if stats["failed"]:
+        return 1
+    return 2 if stats["skipped_by_budget"] else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
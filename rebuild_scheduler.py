@@ -0,0 +1,273 @@
+import datetime
+import heapq
+import itertools
+import logging
+import threading
+from concurrent.futures import Future
+from typing import Callable, Dict, List, Optional, Tuple
+
+from sqlmodel import Session, delete, select
+
+from models.models import RebuildJob, engine
+
+logger = logging.getLogger(__name__)
+
+PRIORITY_ON_DEMAND = 0
+PRIORITY_BACKGROUND = 10
+
+JobKey = Tuple[str, str, str]
+
+
+class _ChampionGroup:
+    def __init__(self):
+        self.jobs: List[Tuple[int, int, JobKey]] = []
+        self.seq = 0
+        self.active = 0
+        self.warm = False
+
+    def accepts_worker(self) -> bool:
+        # the first build fetches and decodes the base files alone, then the group fans out
+        return bool(self.jobs) and (self.warm or self.active == 0)
+
+
+class RebuildScheduler:
+    """Priority scheduler for skin builds on a bounded pool of worker threads.
+
+    Jobs are grouped per champion. The first build of a group runs alone so
+    the champion's base files are fetched and decoded once; after that, idle
+    workers join the group and build its remaining skins in parallel, each in
+    its own scratch workspace. On-demand jobs jump ahead of background ones,
+    both across champions and inside a group. Background jobs are persisted in the RebuildJob table so
+    resume() can pick up what an interrupted run left pending; prune() drops the rows of finished jobs.
+    """
+
+    def __init__(self, runner: Callable[[str, str, str], object], max_workers: int = 4):
+        self.runner = runner
+        self.max_workers = max_workers
+        self.lock = threading.Lock()
+        self.wakeup = threading.Condition(self.lock)
+        self.queue: List[Tuple[int, int, str]] = []
+        self.groups: Dict[str, _ChampionGroup] = {}
+        self.futures: Dict[JobKey, Future] = {}
+        self.persisted: Dict[JobKey, bool] = {}
+        self.counter = itertools.count()
+        self.workers: List[threading.Thread] = []
+        self.running = 0
+        self.completed = 0
+        self.failed = 0
+        self.stopped = False
+
+    def _ensure_workers(self) -> None:
+        while len(self.workers) < self.max_workers:
+            worker = threading.Thread(target=self._work, name=f"rebuild-{len(self.workers)}", daemon=True)
+            self.workers.append(worker)
+            worker.start()
+
+    def submit(self, version: str, champ_id: str, skin_id: str,
+               priority: int = PRIORITY_BACKGROUND, persist: bool = False) -> Future:
+        """Queue a build, or return the future of the identical job already queued."""
+        return self.submit_many([(version, champ_id, skin_id)], priority, persist)[0]
+
+    def submit_many(self, keys: List[JobKey], priority: int = PRIORITY_BACKGROUND,
+                    persist: bool = False) -> List[Future]:
+        """submit() for a batch, persisting all of its jobs in one transaction."""
+        if persist and keys:
+            self._persist(keys, priority)
+        return [self._queue(key, priority, persist) for key in keys]
+
+    def _queue(self, key: JobKey, priority: int, persist: bool) -> Future:
+        _, champ_id, _ = key
+        with self.lock:
+            future = self.futures.get(key)
+            if future is not None:
+                self.persisted[key] = self.persisted.get(key, False) or persist
+                if priority < PRIORITY_BACKGROUND:
+                    self._promote(champ_id, key, priority)
+                return future
+            future = Future()
+            self.futures[key] = future
+            self.persisted[key] = persist
+            group = self.groups.setdefault(champ_id, _ChampionGroup())
+            heapq.heappush(group.jobs, (priority, next(self.counter), key))
+            self._schedule(champ_id, group)
+            self._ensure_workers()
+        return future
+
+    def claim(self, keys: List[JobKey]) -> Tuple[Dict[JobKey, Future], Dict[JobKey, Future]]:
+        """Reserve keys for a build running outside the worker pool (a champion batch).
+
+        Returns (claimed, busy): futures of the keys now reserved, which the
+        caller must settle with release(), and futures of the keys already
+        queued or building. While a key is claimed, submit() hands out its
+        future instead of queuing a second build.
+        """
+        claimed, busy = {}, {}
+        with self.lock:
+            for key in keys:
+                future = self.futures.get(key)
+                if future is not None:
+                    busy[key] = future
+                    continue
+                future = claimed[key] = self.futures[key] = Future()
+                self.persisted[key] = False
+                self.running += 1
+        return claimed, busy
+
+    def release(self, key: JobKey, result: object = None, error: Optional[Exception] = None) -> None:
+        """Settle a key reserved by claim() with its build result or error."""
+        with self.lock:
+            self.running -= 1
+            future = self.futures.pop(key)
+            persisted = self.persisted.pop(key)
+            if error is None:
+                self.completed += 1
+            else:
+                self.failed += 1
+        if persisted:
+            self._finish(key, error)
+        if error is None:
+            future.set_result(result)
+        else:
+            future.set_exception(error)
+
+    def _promote(self, champ_id: str, key: JobKey, priority: int) -> None:
+        group = self.groups.get(champ_id)
+        if group is None:
+            return
+        for i, (job_priority, seq, job_key) in enumerate(group.jobs):
+            if job_key == key and job_priority > priority:
+                group.jobs[i] = (priority, seq, job_key)
+                heapq.heapify(group.jobs)
+                self._schedule(champ_id, group)
+                return
+
+    def _schedule(self, champ_id: str, group: _ChampionGroup) -> None:
+        # a fresh queue entry with the group's best priority; older entries become stale
+        if not group.accepts_worker():
+            return
+        group.seq = next(self.counter)
+        heapq.heappush(self.queue, (group.jobs[0][0], group.seq, champ_id))
+        self.wakeup.notify()
+
+    def _next_group(self) -> Optional[Tuple[str, _ChampionGroup]]:
+        with self.lock:
+            while True:
+                while not self.queue and not self.stopped:
+                    self.wakeup.wait()
+                if self.stopped:
+                    return None
+                _, seq, champ_id = heapq.heappop(self.queue)
+                group = self.groups.get(champ_id)
+                if group is not None and group.seq == seq and group.accepts_worker():
+                    group.active += 1
+                    return champ_id, group
+
+    def _leave(self, champ_id: str, group: _ChampionGroup) -> None:
+        group.active -= 1
+        if not group.jobs and group.active == 0:
+            del self.groups[champ_id]
+
+    def _work(self) -> None:
+        while True:
+            picked = self._next_group()
+            if picked is None:
+                return
+            champ_id, group = picked
+            while True:
+                with self.lock:
+                    if not group.jobs or self.stopped:
+                        self._leave(champ_id, group)
+                        break
+                    if self.queue and self.queue[0][0] < group.jobs[0][0]:
+                        # more urgent work is waiting for another champion, hand this one back
+                        self._leave(champ_id, group)
+                        self._schedule(champ_id, group)
+                        break
+                    _, _, key = heapq.heappop(group.jobs)
+                    self.running += 1
+                    # let idle workers join a warm group while this one builds
+                    self._schedule(champ_id, group)
+                self._run(key)
+                with self.lock:
+                    if not group.warm:
+                        group.warm = True
+                        self._schedule(champ_id, group)
+
+    def _run(self, key: JobKey) -> None:
+        error = None
+        result = None
+        try:
+            result = self.runner(*key)
+        except Exception as e:
+            logger.error(f"Build {key} failed: {e}")
+            error = e
+        self.release(key, result, error)
+
+    def _persist(self, keys: List[JobKey], priority: int) -> None:
+        with Session(engine) as db:
+            for version, champ_id, skin_id in keys:
+                db.merge(RebuildJob(version=version, champion_id=champ_id, skin_id=skin_id, priority=priority))
+            db.commit()
+
+    def _finish(self, key: JobKey, error: Optional[Exception]) -> None:
+        with Session(engine) as db:
+            job = db.get(RebuildJob, key)
+            if job is None:
+                return
+            job.status = "failed" if error else "done"
+            job.error = str(error) if error else None
+            job.finished_at = datetime.datetime.utcnow()
+            db.add(job)
+            db.commit()
+
+    def resume(self, current_version: str) -> List[Future]:
+        """Re-queue background jobs an interrupted run left pending for current_version.
+
+        Jobs of any other version would overwrite current archives with
+        old-patch content, so they are marked superseded instead.
+        """
+        with Session(engine) as db:
+            pending = db.exec(select(RebuildJob).where(RebuildJob.status == "pending")).all()
+            superseded = [job for job in pending if job.version != current_version]
+            for job in superseded:
+                job.status = "superseded"
+                job.finished_at = datetime.datetime.utcnow()
+                db.add(job)
+            db.commit()
+            pending = [(job.version, job.champion_id, job.skin_id, job.priority)
+                       for job in pending if job.version == current_version]
+        if superseded:
+            logger.info(f"Dropped {len(superseded)} pending rebuild jobs of earlier versions")
+        self.prune()
+        if pending:
+            logger.info(f"Resuming {len(pending)} pending rebuild jobs")
+        futures = []
+        for priority in sorted({priority for *_, priority in pending}):
+            keys = [(version, champ_id, skin_id) for version, champ_id, skin_id, job_priority in pending
+                    if job_priority == priority]
+            futures += self.submit_many(keys, priority, persist=True)
+        return futures
+
+    def prune(self) -> int:
+        """Delete the rows of done and superseded jobs; failed ones are kept for inspection."""
+        with Session(engine) as db:
+            deleted = db.exec(delete(RebuildJob).where(RebuildJob.status.in_(("done", "superseded")))).rowcount
+            db.commit()
+        if deleted:
+            logger.info(f"Pruned {deleted} finished rebuild jobs")
+        return deleted
+
+    def status(self) -> Dict[str, int]:
+        with self.lock:
+            return {
+                "queued": sum(len(group.jobs) for group in self.groups.values()),
+                "running": self.running,
+                "completed": self.completed,
+                "failed": self.failed,
+                "workers": self.max_workers,
+            }
+
+    def shutdown(self) -> None:
+        with self.lock:
+            self.stopped = True
+            self.wakeup.notify_all()
@@ -0,0 +1,136 @@
+import asyncio
+import json
+import logging
+import os
+import zipfile
+from typing import AsyncIterator, Awaitable, Callable, Dict, List, Tuple
+
+from fastapi import HTTPException
+from pydantic import BaseModel
+
+from metrics import cache_result
+from models.models import BuildRecord
+from skin_response import hot_archive_cache
+
+logger = logging.getLogger(__name__)
+
+BUNDLE_MAX_SKINS = int(os.getenv("BUNDLE_MAX_SKINS", 20))
+
+SkinPair = Tuple[str, str]
+Resolver = Callable[[str, str], Awaitable[Tuple[BuildRecord, str]]]
+
+
+class BundleSkin(BaseModel):
+    champId: str
+    skinId: str
+
+
+class BundleRequest(BaseModel):
+    skins: List[BundleSkin]
+
+
+class _ZipSink:
+    """Write-only stream the zip writer fills and the response drains.
+
+    It has no tell()/seek(), so zipfile writes data descriptors and never
+    goes back to patch a header.
+    """
+
+    def __init__(self):
+        self.buffer = bytearray()
+
+    def write(self, data: bytes) -> int:
+        self.buffer += data
+        return len(data)
+
+    def flush(self) -> None:
+        pass
+
+    def drain(self) -> bytes:
+        data = bytes(self.buffer)
+        self.buffer.clear()
+        return data
+
+
+def _read_file(path: str) -> bytes:
+    with open(path, "rb") as f:
+        return f.read()
+
+
+async def _archive_bytes(record: BuildRecord, file_path: str) -> bytes:
+    data = hot_archive_cache.get((record.champion_id, record.skin_id), record.content_hash)
+    cache_result("hot_archive", data is not None)
+    if data is None:
+        data = await asyncio.to_thread(_read_file, file_path)
+    return data
+
+
+def unique_pairs(request: BundleRequest) -> List[SkinPair]:
+    pairs = list(dict.fromkeys((skin.champId, skin.skinId) for skin in request.skins))
+    if not pairs:
+        raise HTTPException(status_code=400, detail="No skins requested")
+    if len(pairs) > BUNDLE_MAX_SKINS:
+        raise HTTPException(status_code=400, detail=f"At most {BUNDLE_MAX_SKINS} skins per bundle")
+    return pairs
+
+
+async def stream_bundle(pairs: List[SkinPair], is_cached: Callable[[str, str], bool],
+                        resolve: Resolver) -> AsyncIterator[bytes]:
+    """Yield a zip of the requested archives: cached ones first, the rest as their builds finish.
+
+    Each archive is stored as <champId>/<skinId>.wad.client, and a final
+    bundle.json reports the outcome of every requested skin.
+    """
+
+    async def resolve_pair(pair: SkinPair):
+        try:
+            return pair, await resolve(*pair), None
+        except Exception as e:
+            return pair, None, e
+
+    cached = [pair for pair in pairs if is_cached(*pair)]
+    # builds start right away so they overlap with streaming the cached archives
+    pending = [asyncio.ensure_future(resolve_pair(pair)) for pair in pairs if pair not in cached]
+    sink = _ZipSink()
+    report: Dict[str, dict] = {}
+    try:
+        with zipfile.ZipFile(sink, mode="w", compression=zipfile.ZIP_STORED) as bundle:
+
+            async def add(pair: SkinPair, resolved, error) -> bytes:
+                name = f"{pair[0]}/{pair[1]}.wad.client"
+                data = None
+                if error is None:
+                    record, file_path = resolved
+                    # read the whole archive before its local header goes out, a failure
+                    # here is reported in bundle.json instead of truncating the response
+                    try:
+                        if record is None:
+                            raise FileNotFoundError(file_path)
+                        data = await _archive_bytes(record, file_path)
+                    except OSError as e:
+                        logger.error(f"Reading {file_path} for a bundle failed: {e}")
+                        error = RuntimeError("archive unavailable")
+                if error is not None:
+                    detail = error.detail if isinstance(error, HTTPException) else str(error)
+                    logger.error(f"Bundle entry {name} failed: {detail}")
+                    report[name] = {"status": "failed", "error": detail}
+                    return b""
+                bundle.writestr(name, data)
+                report[name] = {"status": "ok", "size": len(data), "version": record.version,
+                                "content_hash": record.content_hash}
+                return sink.drain()
+
+            for pair in cached:
+                chunk = await add(*(await resolve_pair(pair)))
+                if chunk:
+                    yield chunk
+            for next_done in asyncio.as_completed(pending):
+                chunk = await add(*(await next_done))
+                if chunk:
+                    yield chunk
+            bundle.writestr("bundle.json", json.dumps(report, indent=2))
+        yield sink.drain()
+    finally:
+        # a disconnected client stops waiting; the builds themselves keep running
+        for task in pending:
+            task.cancel()
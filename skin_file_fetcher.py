@@ -1,17 +1,28 @@
 import os.path
+import json
 import logging
+import threading
 logger = logging.getLogger(__name__)
 from bs4 import BeautifulSoup
 from models.models import getApiVersion, Champion, engine
 from sqlmodel import select, Session
-from typing import List
+from typing import Dict, List, Optional, Tuple
 import requests
 from pathlib import Path
+from downloader import DownloadJob, skin_downloader
+from catalog_reads import catalog_reads
+from metrics import cache_result, stage_duration, upstream_responses
+
+COMMUNITY_DRAGON_BASE_URL = os.getenv("COMMUNITY_DRAGON_BASE_URL", "https://raw.communitydragon.org")
+BASE_SKINS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "base_skinsfiles")
+
 
 def get_filtered_community_dragon_links(api_version: str) -> List[str]:
     """Get filtered list of character directories from Community Dragon"""
-    base_url = f"https://raw.communitydragon.org/{api_version}/game/data/characters/"
-    response = requests.get(base_url)
+    base_url = f"{COMMUNITY_DRAGON_BASE_URL}/{api_version}/game/data/characters/"
+    with stage_duration.time(stage="listing"):
+        response = requests.get(base_url)
+    upstream_responses.inc(upstream="cdragon", status=response.status_code)
     response.raise_for_status()  # Raise exception for bad status codes
 
     soup = BeautifulSoup(response.text, 'html.parser')
@@ -34,86 +45,189 @@ def get_filtered_community_dragon_links(api_version: str) -> List[str]:
     ]
 
 
-def write_to_disk(skin_url: str, skin_dir: str, skinNum: str, max_retries: int = 3):
-    urls_to_try = [
-        skin_url,  # Original URL first
-        skin_url.replace(f"skin{skinNum}", "skin0")  # Fallback URL
-    ]
+class CharacterDirectoryIndex:
+    """Per-version index of Community Dragon character directories.
 
-    for attempt, url in enumerate(urls_to_try):
-        try:
-            response = requests.get(url)
-            response.raise_for_status()
+    The filtered listing is fetched once per game version and kept in memory
+    and in base_skinsfiles/<version>/character_dirs.json, together with the
+    champion_code -> directories matches resolved so far.
+    """
+
+    def __init__(self, root_dir: str = None):
+        self.root_dir = root_dir or BASE_SKINS_DIR
+        self.lock = threading.Lock()
+        self.indexes: Dict[str, Dict[str, object]] = {}
 
-            with open(skin_dir, 'wb') as f:
-                f.write(response.content)
-            return  # Success!
+    def _index_path(self, api_version: str) -> str:
+        return os.path.join(self.root_dir, api_version, "character_dirs.json")
 
-        except (requests.exceptions.RequestException, IOError) as e:
-            if attempt == len(urls_to_try) - 1:  # Last attempt failed
-                logger.error(f"Final attempt failed for {url}: {str(e)}")
-                return
-            logger.warning(f"Attempt {attempt + 1} failed, retrying...")
+    def _save(self, api_version: str, index: Dict[str, object]) -> None:
+        path = self._index_path(api_version)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(index, f)
+        os.replace(tmp_path, path)
 
-def save_skin_to_disk(champ_id: str, skin_num: str, api_version: str, champ_dir: str) -> None:
-    """Download and save skin file to organized directory structure"""
+    def _load(self, api_version: str) -> Dict[str, object]:
+        index = self.indexes.get(api_version)
+        if index is not None:
+            return index
+        try:
+            with open(self._index_path(api_version), "r") as f:
+                index = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return self.rebuild(api_version)
+        self.indexes[api_version] = index
+        return index
+
+    def rebuild(self, api_version: str) -> Dict[str, object]:
+        """Fetch the listing again and drop every cached champion match for this version."""
+        directories = get_filtered_community_dragon_links(api_version)
+        index = {"directories": directories, "champions": {}}
+        with self.lock:
+            self._save(api_version, index)
+            self.indexes[api_version] = index
+        logger.info(f"Indexed {len(directories)} character directories for {api_version}")
+        return index
+
+    def is_indexed(self, api_version: str) -> bool:
+        with self.lock:
+            if api_version in self.indexes:
+                return True
+        return os.path.exists(self._index_path(api_version))
+
+    def lookup(self, api_version: str, champ_code: str) -> List[str]:
+        """Return the character directories belonging to a champion code (case-insensitive)."""
+        with self.lock:
+            index = self.indexes.get(api_version)
+        if index is None:
+            index = self._load(api_version)
+        code = champ_code.lower()
+        matches = index["champions"].get(code)
+        cache_result("character_dirs", matches is not None)
+        if matches is None:
+            matches = [d for d in index["directories"] if code in d.lower()]
+            with self.lock:
+                index["champions"][code] = matches
+                self._save(api_version, index)
+        return matches
+
+
+character_index = CharacterDirectoryIndex()
+
+
+def rebuild_character_index(api_version: str, force: bool = False) -> bool:
+    """Index api_version's character directories unless that was already done; returns True if rebuilt."""
+    if not force and character_index.is_indexed(api_version):
+        return False
+    character_index.rebuild(api_version)
+    return True
+
+
+def skin_download_jobs(champ_id: str, skin_num: str, api_version: str, champ_dir: str) -> List[DownloadJob]:
+    """Build the (urls, destination) download jobs for one character directory"""
     # Create base directory if it doesn't exist
-    skin_dir = Path(f"base_skinsfiles/{api_version}/{champ_id}/{champ_dir}")
+    skin_dir = Path(BASE_SKINS_DIR) / api_version / champ_id / champ_dir
     skin_dir.mkdir(parents=True, exist_ok=True)
 
     # Construct paths
-    skin_url = f"https://raw.communitydragon.org/{api_version}/game/data/characters/{champ_dir}/skins/skin{skin_num}.bin"
-    base_skin_url= f"https://raw.communitydragon.org/{api_version}/game/data/characters/{champ_dir}/skins/skin0.bin"
+    skin_url = f"{COMMUNITY_DRAGON_BASE_URL}/{api_version}/game/data/characters/{champ_dir}/skins/skin{skin_num}.bin"
+    base_skin_url= f"{COMMUNITY_DRAGON_BASE_URL}/{api_version}/game/data/characters/{champ_dir}/skins/skin0.bin"
     save_path = skin_dir / f"skin{skin_num}.bin"
 
     logger.info(f"Attempting to fetch skin data from: {skin_url}")
     logger.info(f"Saving to: {save_path}")
+    jobs = []
     if not os.path.exists(f"{skin_dir}/skin0.bin"):
-        write_to_disk(base_skin_url,f"{skin_dir}/skin0.bin",skin_num)
-    write_to_disk(skin_url,save_path,skin_num)
-    logger.info(f"Successfully saved skin {skin_num} for champion {champ_id}")
+        jobs.append(([base_skin_url], f"{skin_dir}/skin0.bin"))
+    jobs.append(([skin_url, base_skin_url], str(save_path)))
+    return jobs
+
 
 # Modified version of your function
-def get_skin_file(champ_key: str, skin_num: str, db: Session) -> None:
+def get_skin_file(champ_key: str, skin_num: str, db: Session, api_version: Optional[str] = None) -> None:
     """Get and save skin files for a specific champion"""
-    # Get champion from database
-    champ = db.exec(
-        select(Champion).where(Champion.id == champ_key)
-    ).first()
+    # Get champion from the cached catalog
+    champ = catalog_reads.champion_sync(champ_key)
 
     if not champ:
         logger.error(f"No champion found with ID {champ_key}")
         return
 
-    # Get API version and adjust format
-    api_version = getApiVersion()
-    if not api_version:
-        logger.error("Could not retrieve API version")
-        return
+    # Get API version and adjust format, unless the caller pinned one for the whole build
+    if api_version is None:
+        api_version = getApiVersion()
+        if not api_version:
+            logger.error("Could not retrieve API version")
+            return
 
-    api_version = api_version[0:-2]  # Remove patch suffix if needed
+        api_version = api_version[0:-2]  # Remove patch suffix if needed
 
-    # Get filtered character directories
-    character_dirs = get_filtered_community_dragon_links(api_version)
-    logger.info(len(character_dirs))
-    # Find matching champion directory (case-insensitive)
-    champ_dirictories =[ d for d in character_dirs if champ.champ_code.lower() in d.lower()]
+    # Find matching champion directories (case-insensitive) in the per-version index
+    champ_dirictories = character_index.lookup(api_version, champ.champ_code)
     if not champ_dirictories:
         logger.error(f"No directory found for champion {champ.champ_code}")
         return
 
-    # Save the skin file
-    for champ_dir in champ_dirictories:
+    # Save the skin files of every directory in one concurrent batch
+    jobs = [
+        job
+        for champ_dir in champ_dirictories
+        for job in skin_download_jobs(champ.id, skin_num, api_version, champ_dir)
+    ]
+    with stage_duration.time(stage="download"):
+        results = skin_downloader.download_many(jobs)
+    for (urls, dest), ok in zip(jobs, results):
+        if not ok:
+            logger.error(f"Could not download {urls[0]} to {dest}")
+    logger.info(f"Saved {sum(results)}/{len(jobs)} files of skin {skin_num} for champion {champ.id}")
 
-        save_skin_to_disk(
-            champ_id=champ.id,
-            skin_num=skin_num,
-            api_version=api_version,
-            champ_dir=champ_dir
-        )
+
+def download_champion_skins(champ_key: str, skin_nums: List[str], api_version: str) -> Dict[str, bool]:
+    """Fetch the files of several skins of one champion in a single download batch.
+
+    Each character folder's base skin is requested once however many skins
+    need it. Returns whether every file of each skin was saved.
+    """
+    champ = catalog_reads.champion_sync(champ_key)
+    if not champ:
+        logger.error(f"No champion found with ID {champ_key}")
+        return {skin_num: False for skin_num in skin_nums}
+    champ_dirictories = character_index.lookup(api_version, champ.champ_code)
+    if not champ_dirictories:
+        logger.error(f"No directory found for champion {champ.champ_code}")
+        return {skin_num: False for skin_num in skin_nums}
+
+    jobs: List[DownloadJob] = []
+    # (character folder, skin) each job belongs to, skin None for the folder's shared base skin
+    owners: List[Tuple[str, Optional[str]]] = []
+    seen = set()
+    for champ_dir in champ_dirictories:
+        for skin_num in skin_nums:
+            for urls, dest in skin_download_jobs(champ.id, skin_num, api_version, champ_dir):
+                if dest in seen:
+                    continue
+                seen.add(dest)
+                jobs.append((urls, dest))
+                owners.append((champ_dir, None if dest.endswith("/skin0.bin") else skin_num))
+    with stage_duration.time(stage="download"):
+        results = skin_downloader.download_many(jobs)
+    # matched folders without a base skin hold no skins, the build skips them like the single-skin path
+    dropped = {champ_dir for (champ_dir, skin_num), ok in zip(owners, results) if skin_num is None and not ok}
+    if dropped:
+        logger.info(f"Skipping {len(dropped)} character folders without skins for champion {champ.id}")
+    kept = [champ_dir for champ_dir in champ_dirictories if champ_dir not in dropped]
+    report = {skin_num: bool(kept) for skin_num in skin_nums}
+    for (urls, dest), (champ_dir, skin_num), ok in zip(jobs, owners, results):
+        if not ok and champ_dir not in dropped:
+            logger.error(f"Could not download {urls[0]} to {dest}")
+            report[skin_num] = False
+    logger.info(f"Saved {sum(results)}/{len(jobs)} files of {len(skin_nums)} skins for champion {champ.id}")
+    return report
 
 
 # Example usage
-def download_skin(champ_key:str,skin_num:str):
+def download_skin(champ_key:str,skin_num:str,api_version: Optional[str] = None):
     with Session(engine) as db:
-        get_skin_file(champ_key, skin_num, db)
+        get_skin_file(champ_key, skin_num, db, api_version)
@@ -0,0 +1,170 @@
+import asyncio
+import logging
+import os
+import re
+import threading
+from collections import OrderedDict
+from datetime import timezone
+from email.utils import formatdate, parsedate_to_datetime
+from typing import Dict, Optional, Tuple
+
+from fastapi import Request
+from fastapi.responses import FileResponse, Response
+
+from metrics import cache_result
+from models.models import BuildRecord
+from version_resolver import version_resolver
+
+logger = logging.getLogger(__name__)
+
+CDN_MAX_AGE = int(os.getenv("CDN_MAX_AGE", 3600))
+_RANGE = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+
+class HotArchiveCache:
+    """Size-bounded LRU of small, frequently requested archives.
+
+    An archive is admitted once it has been requested min_hits times and is
+    keyed by its content hash, so a rebuilt archive never serves stale bytes.
+    """
+
+    def __init__(self, max_bytes: int, max_item_bytes: int, min_hits: int = 2):
+        self.max_bytes = max_bytes
+        self.max_item_bytes = max_item_bytes
+        self.min_hits = min_hits
+        self.lock = threading.Lock()
+        self.entries: "OrderedDict[Tuple[str, str], Tuple[str, bytes]]" = OrderedDict()
+        self.hits: Dict[Tuple[str, str], int] = {}
+        self.size = 0
+
+    def get(self, key: Tuple[str, str], content_hash: str) -> Optional[bytes]:
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] == content_hash:
+                self.entries.move_to_end(key)
+                return entry[1]
+            return None
+
+    def should_admit(self, key: Tuple[str, str], size: int) -> bool:
+        if size > self.max_item_bytes or self.max_bytes <= 0:
+            return False
+        with self.lock:
+            self.hits[key] = self.hits.get(key, 0) + 1
+            if len(self.hits) > 10000:
+                self.hits.clear()
+            return self.hits[key] >= self.min_hits
+
+    def put(self, key: Tuple[str, str], content_hash: str, data: bytes) -> None:
+        with self.lock:
+            old = self.entries.pop(key, None)
+            if old is not None:
+                self.size -= len(old[1])
+            self.entries[key] = (content_hash, data)
+            self.size += len(data)
+            while self.size > self.max_bytes and self.entries:
+                _, (_, evicted) = self.entries.popitem(last=False)
+                self.size -= len(evicted)
+
+    def invalidate(self, key: Tuple[str, str]) -> None:
+        with self.lock:
+            old = self.entries.pop(key, None)
+            if old is not None:
+                self.size -= len(old[1])
+
+
+hot_archive_cache = HotArchiveCache(
+    max_bytes=int(os.getenv("HOT_CACHE_BYTES", 256 * 1024 * 1024)),
+    max_item_bytes=int(os.getenv("HOT_CACHE_MAX_ITEM_BYTES", 8 * 1024 * 1024)),
+    min_hits=int(os.getenv("HOT_CACHE_MIN_HITS", 2)),
+)
+
+
+def _not_modified(request: Request, etag: str, record: BuildRecord) -> bool:
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        tags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+        return "*" in tags or etag in tags
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since:
+        try:
+            since = parsedate_to_datetime(if_modified_since).replace(tzinfo=None)
+        except (TypeError, ValueError):
+            return False
+        return record.built_at.replace(microsecond=0) <= since
+    return False
+
+
+def _parse_range(range_header: str, size: int) -> Optional[Tuple[int, int]]:
+    """Return an inclusive (start, end) for a single bytes range, None when unsatisfiable."""
+    match = _RANGE.match(range_header.strip())
+    if match is None:
+        raise ValueError(range_header)
+    start, end = match.groups()
+    if start == "":
+        if end == "" or int(end) == 0:
+            return None
+        return max(size - int(end), 0), size - 1
+    start = int(start)
+    end = min(int(end), size - 1) if end else size - 1
+    if start >= size or start > end:
+        return None
+    return start, end
+
+
+def cache_headers(record: BuildRecord) -> Dict[str, str]:
+    current = version_resolver.version[:-2] if version_resolver.version else None
+    # archives of the current patch are stable, older ones are about to be rebuilt
+    cache_control = f"public, max-age={CDN_MAX_AGE}" if record.version == current else "no-cache"
+    headers = {
+        "Cache-Control": cache_control,
+        "Last-Modified": formatdate(record.built_at.replace(tzinfo=timezone.utc).timestamp(), usegmt=True),
+        "X-Game-Version": record.version or "unknown",
+    }
+    if record.content_hash:
+        headers["ETag"] = f'"{record.content_hash}"'
+    return headers
+
+
+def _read_file(path: str) -> bytes:
+    with open(path, "rb") as f:
+        return f.read()
+
+
+async def skin_file_response(request: Request, record: BuildRecord, file_path: str, filename: str) -> Response:
+    """Serve an archive with ETag/Last-Modified validation, Range support and the hot cache."""
+    headers = cache_headers(record)
+    etag = headers.get("ETag")
+    if etag is not None and _not_modified(request, etag, record):
+        return Response(status_code=304, headers=headers)
+
+    key = (record.champion_id, record.skin_id)
+    data = hot_archive_cache.get(key, record.content_hash) if etag else None
+    cache_result("hot_archive", data is not None)
+    if data is None and etag and hot_archive_cache.should_admit(key, record.size):
+        data = await asyncio.to_thread(_read_file, file_path)
+        hot_archive_cache.put(key, record.content_hash, data)
+    if data is None:
+        return FileResponse(
+            path=file_path,
+            filename=filename,  # name user sees when saving
+            media_type='application/octet-stream',  # generic binary type
+            headers=headers,
+        )
+
+    headers["Accept-Ranges"] = "bytes"
+    headers["Content-Disposition"] = f'attachment; filename="{filename}"'
+    range_header = request.headers.get("range")
+    if_range = request.headers.get("if-range")
+    if range_header and (if_range is None or if_range in (etag, headers["Last-Modified"])):
+        try:
+            byte_range = _parse_range(range_header, len(data))
+        except ValueError:
+            # multiple or malformed ranges, let FileResponse deal with them
+            return FileResponse(path=file_path, filename=filename, media_type='application/octet-stream', headers=headers)
+        if byte_range is None:
+            return Response(status_code=416, headers={"Content-Range": f"bytes */{len(data)}"})
+        start, end = byte_range
+        headers["Content-Range"] = f"bytes {start}-{end}/{len(data)}"
+        return Response(content=data[start:end + 1], status_code=206, headers=headers,
+                        media_type='application/octet-stream')
+    return Response(content=data, headers=headers, media_type='application/octet-stream')
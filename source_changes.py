@@ -0,0 +1,139 @@
+import json
+import logging
+import os
+from typing import Dict, List, NamedTuple, Optional, Set, Tuple
+
+from catalog_reads import catalog_reads
+from downloader import skin_downloader
+from extractor import source_file_hashes
+from metrics import registry, stage_duration
+from models.models import BuildRecord
+from skin_file_fetcher import BASE_SKINS_DIR, COMMUNITY_DRAGON_BASE_URL, character_index, skin_download_jobs
+
+logger = logging.getLogger(__name__)
+
+SkinKey = Tuple[str, str]
+
+source_checks = registry.counter(
+    "skin_source_checks_total", "Source file comparisons against the last build by outcome.", ("result",)
+)
+
+
+class _SourceCheck(NamedTuple):
+    key: SkinKey
+    champ_dir: str
+    entry: str  # "<folder>/<file>" as recorded in BuildRecord.source_hashes
+    urls: List[str]
+    old_url: Optional[str]
+    old_etag: Optional[str]
+    recorded_hash: str
+
+
+class SourceChangeDetector:
+    """Finds built skins whose source files are the same in a new game version.
+
+    A skin's sources are the pristine skin0.bin and the skinN.bin of each of
+    its character folders, hashed into BuildRecord.source_hashes at build
+    time. Each file is first checked with a HEAD request: an ETag equal to
+    the one kept from the previous download means the file is unchanged.
+    Files with an unknown or different ETag are downloaded into the new
+    version's tree and compared by sha256.
+    """
+
+    def __init__(self, root_dir: str = None):
+        self.root_dir = root_dir or BASE_SKINS_DIR
+
+    def _old_meta(self, record: BuildRecord, folder: str, name: str) -> Dict[str, Optional[str]]:
+        path = os.path.join(self.root_dir, record.version, record.champion_id, folder, f"{name}.meta")
+        try:
+            with open(path, "r") as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
+
+    def _plan(self, api_version: str, record: BuildRecord) -> Optional[List[_SourceCheck]]:
+        """Checks proving a skin unchanged, or None when it has to be rebuilt anyway."""
+        recorded: Dict[str, str] = json.loads(record.source_hashes or "{}")
+        if not recorded or not record.version:
+            return None
+        champ = catalog_reads.champion_sync(record.champion_id)
+        if champ is None:
+            return None
+        champ_dirs = {champ_dir.strip("/"): champ_dir for champ_dir in character_index.lookup(api_version, champ.champ_code)}
+        if set(champ_dirs) != {entry.split("/", 1)[0] for entry in recorded}:
+            return None  # character folders were added or removed
+        checks = []
+        for entry, recorded_hash in recorded.items():
+            folder, name = entry.split("/", 1)
+            base_url = f"{COMMUNITY_DRAGON_BASE_URL}/{api_version}/game/data/characters/{champ_dirs[folder]}/skins/"
+            # same fallback order as the download, a missing skinN.bin is built from skin0.bin
+            urls = [base_url + name] if name == "skin0.bin" else [base_url + name, base_url + "skin0.bin"]
+            meta = self._old_meta(record, folder, name)
+            checks.append(_SourceCheck(
+                (record.champion_id, record.skin_id), champ_dirs[folder], entry, urls,
+                meta.get("url"), meta.get("etag"), recorded_hash,
+            ))
+        return checks
+
+    @staticmethod
+    def _etag_matches(check: _SourceCheck, head: Optional[Tuple[str, Optional[str]]]) -> bool:
+        if head is None or not check.old_etag or not check.old_url:
+            return False
+        url, etag = head
+        return etag == check.old_etag and os.path.basename(url) == os.path.basename(check.old_url)
+
+    def unchanged(self, api_version: str, records: List[BuildRecord]) -> Set[SkinKey]:
+        """Keys of the records whose every source file is identical in api_version."""
+        with stage_duration.time(stage="source_check"):
+            plans: Dict[SkinKey, List[_SourceCheck]] = {}
+            for record in records:
+                try:
+                    checks = self._plan(api_version, record)
+                except Exception as e:
+                    logger.warning(f"Cannot compare sources of {record.champion_id}/{record.skin_id}: {e}")
+                    checks = None
+                if checks is None:
+                    source_checks.inc(result="no_baseline")
+                else:
+                    plans[(record.champion_id, record.skin_id)] = checks
+            all_checks = [check for checks in plans.values() for check in checks]
+            heads = skin_downloader.head_many([check.urls for check in all_checks])
+
+            changed: Set[SkinKey] = set()
+            to_fetch: List[_SourceCheck] = []
+            for check, head in zip(all_checks, heads):
+                if self._etag_matches(check, head):
+                    source_checks.inc(result="etag_match")
+                else:
+                    to_fetch.append(check)
+
+            jobs = {}
+            for check in to_fetch:
+                for urls, dest in skin_download_jobs(check.key[0], check.key[1], api_version, check.champ_dir):
+                    jobs.setdefault(dest, urls)
+            results = dict(zip(jobs, skin_downloader.download_many([(urls, dest) for dest, urls in jobs.items()])))
+            new_hashes: Dict[Tuple[SkinKey, str], Dict[str, str]] = {}
+            for check in to_fetch:
+                if check.key in changed:
+                    continue
+                folder_path = os.path.join(self.root_dir, api_version, check.key[0], check.champ_dir.strip("/"))
+                hashes = new_hashes.get((check.key, folder_path))
+                if hashes is None:
+                    hashes = new_hashes[(check.key, folder_path)] = source_file_hashes(folder_path, check.key[1])
+                if hashes.get(check.entry) == check.recorded_hash:
+                    source_checks.inc(result="hash_match")
+                else:
+                    source_checks.inc(result="changed")
+                    changed.add(check.key)
+            failed = [dest for dest, ok in results.items() if not ok]
+            if failed:
+                logger.warning(f"{len(failed)} source files could not be downloaded for comparison")
+        unchanged = set(plans) - changed
+        logger.info(
+            f"Source check for {api_version}: {len(unchanged)} of {len(records)} skins unchanged, "
+            f"{len(to_fetch)} of {len(all_checks)} files downloaded for comparison"
+        )
+        return unchanged
+
+
+source_change_detector = SourceChangeDetector()
@@ -0,0 +1,191 @@
+import datetime
+import logging
+import os
+import shutil
+import threading
+from typing import Dict, List, Optional, Tuple
+
+from sqlmodel import Session, select
+
+from build_manifest import build_manifest
+from extractor import get_script_dir
+from metrics import registry
+from models.models import ArchiveAccess, engine
+from skin_response import hot_archive_cache
+from version_resolver import version_resolver
+
+logger = logging.getLogger(__name__)
+
+ArchiveKey = Tuple[str, str]
+
+reclaimed_bytes = registry.counter(
+    "skin_storage_reclaimed_bytes_total", "Bytes freed by the storage manager.", ("reason",)
+)
+cdn_bytes = registry.gauge("skin_storage_cdn_bytes", "Bytes used by cdn/ archives at the last storage pass.")
+
+
+def _version_key(version: str) -> Tuple[int, ...]:
+    return tuple(int(part) for part in version.split("."))
+
+
+def _tree_size(path: str) -> int:
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.lstat(os.path.join(root, name)).st_size
+            except FileNotFoundError:
+                pass
+    return total
+
+
+class StorageManager:
+    """Keeps cdn/ under a byte budget and drops the trees of old game versions.
+
+    /skin marks archives as served in memory; every pass flushes those times
+    to the ArchiveAccess table, evicts least recently served archives while
+    cdn/ is over budget, and deletes base_skinsfiles/ and output/ trees of
+    versions older than the current and previous patch. A pass does bounded
+    work so it can run on a worker thread next to live traffic.
+    """
+
+    def __init__(self, script_dir: str = None, budget_bytes: int = None, keep_versions: int = 2,
+                 max_evictions: int = 200):
+        self.script_dir = script_dir or get_script_dir()
+        self.budget_bytes = budget_bytes if budget_bytes is not None else int(os.getenv("CDN_BUDGET_BYTES", 0))
+        self.keep_versions = keep_versions
+        self.max_evictions = max_evictions
+        self.lock = threading.Lock()
+        self.served: Optional[Dict[ArchiveKey, datetime.datetime]] = None
+        self.dirty: Dict[ArchiveKey, datetime.datetime] = {}
+        self.totals = {"evicted": 0, "evicted_bytes": 0, "gc_trees": 0, "gc_bytes": 0}
+        self.run_lock = threading.Lock()
+
+    def touch(self, champ_id: str, skin_id: str) -> None:
+        """Record that an archive was just served."""
+        now = datetime.datetime.utcnow()
+        with self.lock:
+            self.dirty[(champ_id, skin_id)] = now
+            if self.served is not None:
+                self.served[(champ_id, skin_id)] = now
+
+    def _load_and_flush(self) -> Dict[ArchiveKey, datetime.datetime]:
+        with self.lock:
+            dirty, self.dirty = self.dirty, {}
+        with Session(engine) as db:
+            for (champ_id, skin_id), served_at in dirty.items():
+                db.merge(ArchiveAccess(champion_id=champ_id, skin_id=skin_id, last_served=served_at))
+            db.commit()
+            if self.served is None:
+                served = {(row.champion_id, row.skin_id): row.last_served
+                          for row in db.exec(select(ArchiveAccess)).all()}
+                with self.lock:
+                    served.update(self.dirty)
+                    self.served = served
+        return self.served
+
+    def _archives(self) -> List[Tuple[datetime.datetime, ArchiveKey, str, int]]:
+        """(last served, key, path, size) of every archive in cdn/."""
+        cdn_dir = os.path.join(self.script_dir, "cdn")
+        served = self.served or {}
+        archives = []
+        if not os.path.isdir(cdn_dir):
+            return archives
+        for champ_entry in os.scandir(cdn_dir):
+            if not champ_entry.is_dir():
+                continue
+            for entry in os.scandir(champ_entry.path):
+                if not entry.name.endswith(".wad.client"):
+                    continue
+                key = (champ_entry.name, entry.name[:-len(".wad.client")])
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                record = build_manifest.get(*key)
+                # never served since the manager started tracking: fall back to the build time
+                last = served.get(key) or (record.built_at if record else
+                                           datetime.datetime.utcfromtimestamp(stat.st_mtime))
+                archives.append((last, key, entry.path, stat.st_size))
+        return archives
+
+    def evict(self) -> Tuple[int, int]:
+        """Delete least recently served archives until cdn/ fits the budget; returns (files, bytes)."""
+        archives = self._archives()
+        used = sum(size for _, _, _, size in archives)
+        cdn_bytes.set(used)
+        if not self.budget_bytes or used <= self.budget_bytes:
+            return 0, 0
+        evicted = freed = 0
+        for _, key, path, size in sorted(archives)[:self.max_evictions]:
+            if used <= self.budget_bytes:
+                break
+            # delete the file first: a request in between sees a record without a file and
+            # rebuilds, while the reverse order let it adopt a file that was about to vanish
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            build_manifest.remove(*key)
+            hot_archive_cache.invalidate(key)
+            used -= size
+            evicted += 1
+            freed += size
+        reclaimed_bytes.inc(freed, reason="evicted")
+        cdn_bytes.set(used)
+        logger.info(f"Evicted {evicted} archives ({freed} bytes), cdn/ now uses {used} bytes")
+        return evicted, freed
+
+    def stale_trees(self) -> List[str]:
+        """Version trees of base_skinsfiles/ and output/ older than the kept patches."""
+        current = version_resolver.version
+        if not current:
+            return []
+        current = current.rsplit(".", 1)[0] if current.count(".") > 1 else current
+        trees = []
+        for root_name in ("base_skinsfiles", "output"):
+            root = os.path.join(self.script_dir, root_name)
+            if not os.path.isdir(root):
+                continue
+            for name in os.listdir(root):
+                try:
+                    trees.append((_version_key(name), os.path.join(root, name)))
+                except ValueError:
+                    continue
+        # the current patch plus keep_versions - 1 earlier ones survive, in every tree
+        older = sorted({version for version, _ in trees if version < _version_key(current)}, reverse=True)
+        kept = set(older[:self.keep_versions - 1])
+        return [path for version, path in sorted(trees) if version < _version_key(current) and version not in kept]
+
+    def collect_versions(self, max_trees: int = 1) -> Tuple[int, int]:
+        """Delete up to max_trees stale version trees; returns (trees, bytes)."""
+        removed = freed = 0
+        for path in self.stale_trees()[:max_trees]:
+            size = _tree_size(path)
+            shutil.rmtree(path, ignore_errors=True)
+            removed += 1
+            freed += size
+            logger.info(f"Removed old version tree {path} ({size} bytes)")
+        reclaimed_bytes.inc(freed, reason="old_version")
+        return removed, freed
+
+    def run_once(self) -> Dict[str, int]:
+        """One bounded maintenance pass, safe to call from a background thread."""
+        if not self.run_lock.acquire(blocking=False):
+            return {}
+        try:
+            self._load_and_flush()
+            evicted, evicted_bytes = self.evict()
+            trees, tree_bytes = self.collect_versions()
+            report = {"evicted": evicted, "evicted_bytes": evicted_bytes, "gc_trees": trees, "gc_bytes": tree_bytes}
+            for key, value in report.items():
+                self.totals[key] += value
+            return report
+        finally:
+            self.run_lock.release()
+
+    def status(self) -> Dict[str, int]:
+        return dict(self.totals, budget_bytes=self.budget_bytes)
+
+
+storage_manager = StorageManager(keep_versions=int(os.getenv("KEEP_VERSIONS", 2)))
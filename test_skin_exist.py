@@ -1,11 +1,13 @@
 import asyncio
-from sqlmodel import select, SQLModel, create_engine,Session
-from sqlalchemy.orm import selectinload
-from models.models import Champion,engine  # Assuming Champion is defined in models
+import os
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+from sqlmodel import select, Session
+from catalog_index import CatalogSkin, catalog_index
+from models.models import SkinAvailability, engine, getApiVersion
 import logging
-from aiohttp import ClientSession, ClientTimeout
+from aiohttp import ClientError, ClientSession, ClientTimeout
 
-bugged_skins = []
 # Configure logging
 logging.basicConfig(
     level=logging.ERROR,
@@ -15,48 +17,102 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+SKINS_REPO_URL = "https://raw.githubusercontent.com/darkseal-org/lol-skins/main"
+SKIN_CHECK_CONCURRENCY = int(os.getenv("SKIN_CHECK_CONCURRENCY", 16))
+SKIN_CHECK_RETRIES = int(os.getenv("SKIN_CHECK_RETRIES", 3))
+SKIN_CHECK_TTL = timedelta(hours=float(os.getenv("SKIN_CHECK_TTL_HOURS", 24)))
 
-async def check_skin_exists(session: ClientSession, champ_name: str, skin_name: str):
+SkinKey = Tuple[str, str]
+
+
+def skin_zip_url(champ_name: str, skin_name: str) -> str:
     skin_path = f"skins/{champ_name}/{skin_name.replace('/', ' ').replace(':', '')}.zip"
-    url = f"https://raw.githubusercontent.com/darkseal-org/lol-skins/main/{skin_path}"
-
-    try:
-        async with session.head(url, allow_redirects=True) as response:
-            if response.status != 200:
-                bugged_skins.append((champ_name,skin_name))
-                return False
-            return True
-    except Exception as e:
-        logger.error(f"{champ_name} - {skin_name} - Error: {str(e)}")
-        return False
-
-
-async def process_skins(champions, http_session):
-    tasks = []
-    for champ in champions:
-        for skin in champ.skins:
-            if skin.skin_name != "default":
-                tasks.append(
-                    check_skin_exists(
-                        http_session,
-                        champ.champ_name,
-                        skin.skin_name
-                    )
-                )
-    await asyncio.gather(*tasks)
-
-
-async def main():
-    # Load all data synchronously (better for SQLite)
+    return f"{SKINS_REPO_URL}/{skin_path}"
+
+
+async def check_skin_exists(session: ClientSession, limit: asyncio.Semaphore,
+                            champ_name: str, skin_name: str) -> Optional[int]:
+    """HEAD the skin's zip; returns the final status code, or None if every attempt failed."""
+    url = skin_zip_url(champ_name, skin_name)
+    for attempt in range(SKIN_CHECK_RETRIES):
+        try:
+            async with limit:
+                async with session.head(url, allow_redirects=True) as response:
+                    if response.status != 429 and response.status < 500:
+                        return response.status
+                    error = f"HTTP {response.status}"
+        except (ClientError, asyncio.TimeoutError) as e:
+            error = str(e) or type(e).__name__
+        await asyncio.sleep(0.5 * 2 ** attempt)
+    logger.error(f"{champ_name} - {skin_name} - Error: {error}")
+    return None
+
+
+def skins_due(catalog: List[CatalogSkin], results: Dict[SkinKey, SkinAvailability], now: datetime) -> List[CatalogSkin]:
+    """Skins without a result for this version, or whose result is older than the TTL."""
+    due = []
+    for skin in catalog:
+        if skin.skin_name == "default":
+            continue
+        result = results.get((skin.champion_id, skin.skin_id))
+        if result is None or now - result.checked_at > SKIN_CHECK_TTL:
+            due.append(skin)
+    return due
+
+
+def load_results(version: str) -> Dict[SkinKey, SkinAvailability]:
+    with Session(engine) as db:
+        return {
+            (row.champion_id, row.skin_id): row
+            for row in db.exec(select(SkinAvailability).where(SkinAvailability.version == version)).all()
+        }
+
+
+def store_results(rows: List[SkinAvailability]) -> None:
     with Session(engine) as db:
-        champions = db.exec(
-            select(Champion)
-            .options(selectinload(Champion.skins))
-        ).all()
-
-    # Process HTTP requests asynchronously
-    async with ClientSession(
-            headers={"User-Agent": "Mozilla/5.0"},
-            timeout=ClientTimeout(total=10)
-    ) as http_session:
-        await process_skins(champions, http_session)
+        for row in rows:
+            db.merge(row)
+        db.commit()
+
+
+async def check_skins(version: Optional[str] = None) -> List[Tuple[str, str]]:
+    """Re-check the skins that are due and return every (champ_id, skin_id) missing for version.
+
+    Results are stored per (skin, version) in SkinAvailability, so a run
+    only issues requests for new skins, a new game version, or results past
+    SKIN_CHECK_TTL; failed checks are not stored and are retried next run.
+    Database reads and the final write run in worker threads, off the loop.
+    """
+    version = version or (await asyncio.to_thread(getApiVersion))[:-2]
+    now = datetime.utcnow()
+    # the catalog is only reloaded after seed_database changed it
+    catalog = await asyncio.to_thread(catalog_index.skins)
+    results = await asyncio.to_thread(load_results, version)
+    due = skins_due(catalog, results, now)
+
+    if due:
+        limit = asyncio.Semaphore(SKIN_CHECK_CONCURRENCY)
+        async with ClientSession(
+                headers={"User-Agent": "Mozilla/5.0"},
+                timeout=ClientTimeout(total=10)
+        ) as http_session:
+            statuses = await asyncio.gather(*(
+                check_skin_exists(http_session, limit, skin.champ_name, skin.skin_name)
+                for skin in due
+            ))
+        checked = [
+            SkinAvailability(champion_id=skin.champion_id, skin_id=skin.skin_id, version=version,
+                             available=status == 200, status_code=status, checked_at=now)
+            for skin, status in zip(due, statuses)
+            if status is not None
+        ]
+        await asyncio.to_thread(store_results, checked)
+        results.update(((row.champion_id, row.skin_id), row) for row in checked)
+        logger.info(f"Checked {len(due)} skins for {version}")
+
+    skin_ids = {(skin.champion_id, skin.skin_id) for skin in catalog}
+    return [key for key, row in results.items() if not row.available and key in skin_ids]
+
+
+async def main(version: Optional[str] = None) -> List[Tuple[str, str]]:
+    return await check_skins(version)
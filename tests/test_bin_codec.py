@@ -0,0 +1,53 @@
+import glob
+import os
+
+import pytest
+
+from bin_codec import patch_entry_keys, patch_entry_keys_tree, read_bin, read_entry_keys, verify_against_ritobin, write_bin
+from extractor import get_script_dir, rito_bin_executer
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+BASE_BIN = os.path.join(FIXTURES, "skin0.bin")
+SKIN_BINS = [os.path.join(FIXTURES, name) for name in ("skin1.bin", "skin2.bin")]
+# <skin>.patched.bin is the expected result of patching <skin>.bin with the keys of the
+# skin0.bin next to it. The goldens of the synthetic fixtures above were written by
+# pyritofile, an independent BIN implementation; `python bin_codec.py --golden` writes
+# ritobin's output for real game BINs added in their own folder.
+GOLDENS = sorted(glob.glob(os.path.join(FIXTURES, "**", "*.patched.bin"), recursive=True))
+
+
+def _read(path: str) -> bytes:
+    with open(path, "rb") as f:
+        return f.read()
+
+
+@pytest.mark.parametrize("path", [BASE_BIN] + SKIN_BINS)
+def test_round_trip_is_byte_identical(path):
+    data = _read(path)
+    assert write_bin(read_bin(data)) == data
+
+
+@pytest.mark.parametrize("path", SKIN_BINS)
+def test_in_place_patch_matches_tree_patch(path):
+    title_key, resolver_key = read_entry_keys(_read(BASE_BIN))
+    data = _read(path)
+    patched = patch_entry_keys(data, title_key, resolver_key)
+    assert patched == patch_entry_keys_tree(data, title_key, resolver_key)
+    assert read_entry_keys(patched) == (title_key, resolver_key)
+
+
+@pytest.mark.parametrize("golden", GOLDENS, ids=lambda path: os.path.relpath(path, FIXTURES))
+def test_native_patch_matches_golden(golden):
+    title_key, resolver_key = read_entry_keys(_read(os.path.join(os.path.dirname(golden), "skin0.bin")))
+    data = _read(golden.replace(".patched.bin", ".bin"))
+    expected = _read(golden)
+    assert patch_entry_keys(data, title_key, resolver_key) == expected
+    assert patch_entry_keys_tree(data, title_key, resolver_key) == expected
+
+
+@pytest.mark.skipif(not os.access(rito_bin_executer(get_script_dir()), os.X_OK), reason="ritobin is not installed")
+@pytest.mark.parametrize("path", SKIN_BINS)
+def test_native_patch_matches_ritobin(path):
+    assert verify_against_ritobin(get_script_dir(), BASE_BIN, path) == {
+        "keys": True, "in_place": True, "tree": True, "round_trip": True,
+    }
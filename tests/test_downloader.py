@@ -0,0 +1,106 @@
+import asyncio
+import json
+import os
+import threading
+from collections import Counter
+
+import pytest
+from aiohttp import web
+
+from downloader import SkinDownloader
+
+SKIN0 = b"base skin bytes"
+
+
+@pytest.fixture(scope="module")
+def server():
+    """Local stand-in for Community Dragon, served from its own event loop thread."""
+    hits = Counter()
+    conditional = Counter()
+
+    async def skin0(request):
+        hits[request.path] += 1
+        if request.headers.get("If-None-Match") == '"v1"':
+            conditional[request.path] += 1
+            return web.Response(status=304)
+        return web.Response(body=SKIN0, headers={"ETag": '"v1"'})
+
+    async def missing(request):
+        hits[request.path] += 1
+        return web.Response(status=404)
+
+    async def flaky(request):
+        hits[request.path] += 1
+        if hits[request.path] <= 2:
+            return web.Response(status=500)
+        return web.Response(body=b"third time lucky")
+
+    app = web.Application()
+    app.router.add_get("/skins/skin0.bin", skin0)
+    app.router.add_get("/skins/skin1.bin", missing)
+    app.router.add_get("/skins/skin2.bin", missing)
+    app.router.add_get("/flaky.bin", flaky)
+
+    loop = asyncio.new_event_loop()
+    threading.Thread(target=loop.run_forever, daemon=True).start()
+    runner = web.AppRunner(app)
+    asyncio.run_coroutine_threadsafe(runner.setup(), loop).result()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    asyncio.run_coroutine_threadsafe(site.start(), loop).result()
+    port = runner.addresses[0][1]
+    yield f"http://127.0.0.1:{port}", hits, conditional
+    asyncio.run_coroutine_threadsafe(runner.cleanup(), loop).result()
+    loop.call_soon_threadsafe(loop.stop)
+
+
+@pytest.fixture
+def downloader():
+    engine = SkinDownloader(limit=4, limit_per_host=4)
+    yield engine
+    engine.close()
+
+
+def test_falls_back_to_the_next_url_on_404(server, downloader, tmp_path):
+    base_url, hits, _ = server
+    dest = str(tmp_path / "skin1.bin")
+    assert downloader.download_many([([f"{base_url}/skins/skin1.bin", f"{base_url}/skins/skin0.bin"], dest)]) == [True]
+    with open(dest, "rb") as f:
+        assert f.read() == SKIN0
+    with open(f"{dest}.meta", "r") as f:
+        meta = json.load(f)
+    assert meta["url"] == f"{base_url}/skins/skin0.bin"
+    assert meta["etag"] == '"v1"'
+
+
+def test_missing_everywhere_fails_without_a_file(server, downloader, tmp_path):
+    base_url, hits, _ = server
+    dest = str(tmp_path / "skin2.bin")
+    before = hits["/skins/skin2.bin"]
+    assert downloader.download_many([([f"{base_url}/skins/skin2.bin"], dest)]) == [False]
+    # a 404 is final, it is not retried
+    assert hits["/skins/skin2.bin"] == before + 1
+    assert not os.path.exists(dest)
+
+
+def test_server_errors_are_retried(server, downloader, tmp_path):
+    base_url, hits, _ = server
+    dest = str(tmp_path / "flaky.bin")
+    assert downloader.download_many([([f"{base_url}/flaky.bin"], dest)]) == [True]
+    assert hits["/flaky.bin"] == 3
+    with open(dest, "rb") as f:
+        assert f.read() == b"third time lucky"
+
+
+def test_meta_sidecar_makes_the_next_request_conditional(server, downloader, tmp_path):
+    base_url, _, conditional = server
+    dest = str(tmp_path / "skin0.bin")
+    job = ([f"{base_url}/skins/skin0.bin"], dest)
+    assert downloader.download_many([job]) == [True]
+    modified_at = os.stat(dest).st_mtime_ns
+    before = conditional["/skins/skin0.bin"]
+
+    assert downloader.download_many([job]) == [True]
+    assert conditional["/skins/skin0.bin"] == before + 1
+    # a 304 leaves the file alone
+    assert os.stat(dest).st_mtime_ns == modified_at
+    assert not [name for name in os.listdir(tmp_path) if name.endswith(".part")]
@@ -0,0 +1,96 @@
+import json
+import logging
+import os
+import threading
+import time
+from typing import Optional
+
+import requests
+
+from metrics import stage_duration, upstream_responses
+
+logger = logging.getLogger(__name__)
+
+DDRAGON_BASE_URL = os.getenv("DDRAGON_BASE_URL", "https://ddragon.leagueoflegends.com")
+
+
+class VersionResolver:
+    """Shared, cached view of the latest ddragon game version.
+
+    The value is kept in memory for ttl seconds, then revalidated with
+    If-None-Match/If-Modified-Since. The last known version is persisted so a
+    restart works while ddragon is unreachable.
+    """
+
+    def __init__(self, url: str = None, state_file: str = None, ttl: float = None):
+        self.url = url or f"{DDRAGON_BASE_URL}/api/versions.json"
+        self.state_file = state_file or os.getenv(
+            "API_VERSION_STATE_FILE", os.path.join(os.path.dirname(os.path.abspath(__file__)), "api_version.json")
+        )
+        self.ttl = ttl if ttl is not None else float(os.getenv("API_VERSION_TTL", 300))
+        self.lock = threading.RLock()
+        self.version: Optional[str] = None
+        self.etag: Optional[str] = None
+        self.last_modified: Optional[str] = None
+        self.checked_at = 0.0
+        self._load()
+
+    def _load(self) -> None:
+        try:
+            with open(self.state_file, "r") as f:
+                state = json.load(f)
+            self.version = state["version"]
+            self.etag = state.get("etag")
+            self.last_modified = state.get("last_modified")
+        except (FileNotFoundError, KeyError, json.JSONDecodeError):
+            pass
+
+    def _save(self) -> None:
+        tmp_path = f"{self.state_file}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"version": self.version, "etag": self.etag, "last_modified": self.last_modified}, f)
+        os.replace(tmp_path, self.state_file)
+
+    def is_fresh(self) -> bool:
+        return self.version is not None and time.monotonic() - self.checked_at < self.ttl
+
+    def get(self) -> str:
+        """Return the cached version, revalidating it once the TTL has expired."""
+        if self.is_fresh():
+            return self.version
+        with self.lock:
+            if self.is_fresh():
+                return self.version
+            return self.refresh()
+
+    def refresh(self) -> str:
+        """Ask ddragon for the latest version now, whatever the TTL says."""
+        with self.lock:
+            headers = {}
+            if self.version is not None:
+                if self.etag:
+                    headers["If-None-Match"] = self.etag
+                if self.last_modified:
+                    headers["If-Modified-Since"] = self.last_modified
+            try:
+                with stage_duration.time(stage="api_version"):
+                    response = requests.get(self.url, headers=headers, timeout=10)
+                upstream_responses.inc(upstream="ddragon", status=response.status_code)
+                if response.status_code != 304:
+                    response.raise_for_status()
+                    version = json.loads(response.text)[0]
+                    if version != self.version:
+                        logger.info(f"Game version changed: {self.version} -> {version}")
+                    self.version = version
+                    self.etag = response.headers.get("ETag")
+                    self.last_modified = response.headers.get("Last-Modified")
+                    self._save()
+            except (requests.exceptions.RequestException, ValueError, IndexError, OSError) as e:
+                if self.version is None:
+                    raise RuntimeError(f"Could not resolve game version: {e}") from e
+                logger.warning(f"Version check failed, keeping {self.version}: {e}")
+            self.checked_at = time.monotonic()
+            return self.version
+
+
+version_resolver = VersionResolver()
@@ -0,0 +1,117 @@
+import hashlib
+import logging
+import os
+import struct
+import tempfile
+from typing import Iterable, List, Tuple
+
+from hashing import wad_path_hash
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+logger = logging.getLogger(__name__)
+
+WAD_MAJOR = 3
+WAD_MINOR = 0
+HEADER_SIZE = 4 + 256 + 8 + 4
+TOC_ENTRY_SIZE = 32
+
+COMPRESSION_NONE = 0
+COMPRESSION_ZSTD = 3
+
+
+def default_compression() -> str:
+    return "zstd" if zstandard is not None else "none"
+
+
+def _checksum(data: bytes) -> int:
+    # WAD 3.0 entries carry the first 8 bytes of the SHA-256 of the stored data
+    return struct.unpack("<Q", hashlib.sha256(data).digest()[:8])[0]
+
+
+def write_wad(output_file: str, entries: Iterable[Tuple[str, bytes]], compression: str = None) -> Tuple[int, str]:
+    """Stream (virtual path, bytes) pairs into a .wad.client archive.
+
+    The archive is written next to output_file and renamed over it only once
+    it is complete, so readers never see a partial file. Returns the archive
+    size and a content hash (SHA-256 of the table of contents, which covers
+    every path hash and entry checksum).
+    """
+    compression = compression or default_compression()
+    if compression == "zstd" and zstandard is None:
+        raise RuntimeError("zstd compression requested but the zstandard package is not installed")
+    compressor = zstandard.ZstdCompressor(level=3) if compression == "zstd" else None
+
+    hashed: List[Tuple[int, bytes]] = []
+    seen = set()
+    for path, data in entries:
+        path_hash = wad_path_hash(path)
+        if path_hash in seen:
+            raise ValueError(f"Duplicate WAD path: {path}")
+        seen.add(path_hash)
+        hashed.append((path_hash, data))
+    hashed.sort(key=lambda entry: entry[0])
+
+    output_dir = os.path.dirname(output_file) or "."
+    os.makedirs(output_dir, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=output_dir, prefix=".", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            offset = HEADER_SIZE + TOC_ENTRY_SIZE * len(hashed)
+            f.seek(offset)
+            toc = []
+            stored = {}
+            for path_hash, data in hashed:
+                stored_data = compressor.compress(data) if compressor else data
+                checksum = _checksum(stored_data)
+                if checksum in stored:
+                    # identical content is stored once and referenced by every duplicate
+                    toc.append((path_hash,) + stored[checksum][:4] + (1, checksum))
+                    continue
+                entry_type = COMPRESSION_ZSTD if compressor else COMPRESSION_NONE
+                stored[checksum] = (offset, len(stored_data), len(data), entry_type)
+                toc.append((path_hash, offset, len(stored_data), len(data), entry_type, 0, checksum))
+                f.write(stored_data)
+                offset += len(stored_data)
+
+            toc_bytes = b"".join(
+                struct.pack("<QIIIBBHQ", path_hash, data_offset, size, uncompressed, entry_type, duplicate, 0, checksum)
+                for path_hash, data_offset, size, uncompressed, entry_type, duplicate, checksum in toc
+            )
+            f.seek(0)
+            f.write(b"RW" + bytes((WAD_MAJOR, WAD_MINOR)))
+            f.write(b"\0" * 256)
+            f.write(struct.pack("<QI", 0, len(toc)))
+            f.write(toc_bytes)
+            f.flush()
+            os.fsync(f.fileno())
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, output_file)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    logger.info(f"Wrote {len(hashed)} entries ({offset} bytes) to {output_file}")
+    return offset, hashlib.sha256(toc_bytes).hexdigest()
+
+
+def wad_content_hash(path: str) -> str:
+    """Content hash of an existing archive, the same value write_wad returns for it.
+
+    Files that are not WAD 3 archives fall back to the SHA-256 of the whole file.
+    """
+    with open(path, "rb") as f:
+        header = f.read(HEADER_SIZE)
+        if len(header) == HEADER_SIZE and header[:2] == b"RW" and header[2] == WAD_MAJOR:
+            (count,) = struct.unpack_from("<I", header, HEADER_SIZE - 4)
+            toc_bytes = f.read(TOC_ENTRY_SIZE * count)
+            if len(toc_bytes) == TOC_ENTRY_SIZE * count:
+                return hashlib.sha256(toc_bytes).hexdigest()
+        f.seek(0)
+        digest = hashlib.sha256()
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+        return digest.hexdigest()